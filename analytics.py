@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# Looks for drifting channels and outlier wires across the tests saved in the results store (see results.py).
+# Every Continuity and Load resistance and Hi-Pot isolation of the store is loaded in arrays and grouped by mapping
+# and channel. Each channel gets a baseline (median and median absolute deviation of its population) and a trend
+# over time, and the wires that pass maxWireR or minIsolationR but are far from their channel population are listed.
+# The text reports written before the results store can be imported first, they are parsed in parallel.
+import argparse
+import concurrent.futures
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+from datetime import datetime
+
+import numpy as np
+from engineering_notation import EngNumber
+
+import vacFeedTester
+
+
+units = {'Cont. Load': 'ohm', 'HiPot': 'ohm'}
+mappings = ['science_raft_channel_mapping.csv', 'corner_raft_channel_mapping.csv']
+# Relative resolution of the values, the smallest channel spread
+resolution = 1e-4
+
+rowPattern = re.compile(r'^(?:Cont\. Load|HiPot) \((\d+)/\d+\)$')
+baselinePattern = re.compile(r'^    -- (\d+)H (OK|Error) +(\S+)\|(\S+) v')
+continuityPattern = re.compile(r'^(\d+)H -- (\d+)H (OK|Error) +(\S+)ohm +(\S+)\|(\S+) v')
+hiPotPattern = re.compile(r'^(\d+)H,(\d+)H -/- (\d+)H (OK|Error) +(?:HI ohm +- A leakage|(\S+)ohm +(\S+)A leakage) +(\S+)\|(\S+) v')
+
+
+def loadValues(db, test):
+    # Tests (id, cable name, mapping and time in seconds) and their wires (test index, 44 pins and 37 pins channels,
+    # value and verdict). Hi-Pot values are the log10 of the isolation, wires above the DMM impedance have none
+    tests = db.execute("SELECT id, name, IFNULL(mappingHash, ''), "
+                       'CAST(ROUND((julianday(time) - 2440587.5) * 86400) AS INTEGER) FROM tests '
+                       'WHERE test = ? AND error IS NULL ORDER BY id', [test]).fetchall()
+    if len(tests) == 0:
+        return None
+    ids, names, hashes, times = zip(*tests)
+    hashes, mappings = np.unique(np.array(hashes), return_inverse=True)
+    wires = np.array(db.execute('SELECT wires.test, wires.pin44, wires.pin37, IFNULL(wires.r, 0), '
+                                'wires.r IS NULL OR (? AND wires.leakage IS NULL), wires.passed '
+                                'FROM wires JOIN tests ON wires.test = tests.id '
+                                'WHERE tests.test = ? AND tests.error IS NULL', [test == 'HiPot', test]).fetchall(),
+                     dtype=float).reshape(-1, 6)
+    value = wires[:, 3]
+    value[wires[:, 4] > 0] = np.nan
+    if test == 'HiPot':
+        value[value <= 0] = np.nan
+        value = np.log10(value, where=np.isfinite(value), out=np.full(len(value), np.nan))
+    ids = np.array(ids)
+    return {'tests': {'id': ids, 'name': np.array(names), 'mapping': mappings.ravel(), 'time': np.array(times, dtype=float)},
+            'test': np.searchsorted(ids, wires[:, 0].astype(int)), 'pin44': wires[:, 1].astype(int),
+            'pin37': wires[:, 2].astype(int), 'value': value, 'passed': wires[:, 5] > 0}
+
+
+def groupMedians(groups, values, count):
+    # Median of the values of each group, groups numbered 0 to count - 1, none empty
+    order = np.lexsort((values, groups))
+    ordered = values[order]
+    counts = np.bincount(groups, minlength=count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return (ordered[starts + (counts - 1) // 2] + ordered[starts + counts // 2]) / 2
+
+
+def analyze(data, threshold, minCount):
+    # Baseline of each channel and robust z-score of each wire against it, then the trend of each channel and its
+    # t-statistic
+    valid = np.isfinite(data['value'])
+    data = dict({key: column[valid] for key, column in data.items() if key != 'tests'}, tests=data['tests'])
+    mapping = data['tests']['mapping'][data['test']]
+    keys, groups = np.unique((mapping * 1000 + data['pin44']) * 1000 + data['pin37'], return_inverse=True)
+    groups = groups.ravel()
+    count = len(keys)
+    values = data['value']
+
+    median = groupMedians(groups, values, count)
+    deviation = np.abs(values - median[groups])
+    # The spread of a channel can't be below the report resolution, MAD is 0 when most of its values are equal
+    scale = np.maximum(1.4826 * groupMedians(groups, deviation, count), resolution * np.abs(median))
+    population = np.bincount(groups, minlength=count)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(scale[groups] > 0, (values - median[groups]) / scale[groups], 0.0)
+    outliers = data['passed'] & (np.abs(z) >= threshold) & (population[groups] >= minCount)
+
+    # Least squares slope of each channel over time, fitted on its passing wires close to the baseline and scaled to
+    # its spread over the time span of its tests. The times are centered on the mean of each channel, tests seconds
+    # apart would be lost in the sums of squares otherwise
+    fit = (data['passed'] & (np.abs(z) < threshold)).astype(float)
+    n = np.bincount(groups, fit, count)
+    t = data['tests']['time'][data['test']]
+    t = t - t.min()
+    fitted = np.maximum(n, 1)
+    t = (t - (np.bincount(groups, fit * t, count) / fitted)[groups]) * fit
+    x = (values - (np.bincount(groups, fit * values, count) / fitted)[groups]) * fit
+    stt = np.bincount(groups, t * t, count)
+    stx = np.bincount(groups, t * x, count)
+    sxx = np.bincount(groups, x * x, count)
+    span = np.zeros(count)
+    np.maximum.at(span, groups, t)
+    first = np.zeros(count)
+    np.minimum.at(first, groups, t)
+    span -= first
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(stt > 0, stx / stt, 0.0)
+        # Slope over its standard error, from the residuals of the fit with n - 2 degrees of freedom: Student's t
+        # under the hypothesis of a channel that doesn't drift
+        residuals = np.maximum(sxx - slope * stx, 0.0)
+        error = np.sqrt(residuals / np.maximum(n - 2, 1) / stt)
+        tStat = np.where(error > 0, slope / error, np.where(slope != 0, np.inf, 0.0))
+    drift = slope * span / scale
+    judged = (n >= minCount) & (n > 2) & (stt > 0)
+    drift[~judged] = 0.0
+    tStat[~judged] = 0.0
+
+    return {'data': data, 'keys': keys, 'groups': groups, 'median': median, 'scale': scale,
+            'population': population, 'z': z, 'outliers': outliers, 'slope': slope, 'drift': drift, 't': tStat}
+
+
+def display(test, value):
+    # Hi-Pot values are analyzed as log10 of the isolation
+    if test == 'HiPot':
+        value = 10 ** value
+    return f"{EngNumber(value)}{units[test]}"
+
+
+def printAnalysis(test, result, top, trendT):
+    data = result['data']
+    names, ids = data['tests']['name'][data['test']], data['tests']['id'][data['test']]
+    outliers = np.flatnonzero(result['outliers'])
+    print(f"\n{test}: {len(data['value'])} wires of {len(np.unique(ids))} tests, {len(result['median'])} channels, "
+          f"{len(outliers)} passing wires far from their channel")
+
+    if len(outliers) > 0:
+        cables, counts = np.unique(names[outliers], return_counts=True)
+        print(f"\n{'cable':<20}{'outliers':>9}")
+        for i in np.argsort(-counts)[:top]:
+            print(f"{cables[i]:<20}{counts[i]:>9}")
+
+        print(f"\n{'cable':<20}{'test':>6}  {'wire':<12}{'value':>12}{'median':>12}{'z':>8}")
+        for i in outliers[np.argsort(-np.abs(result['z'][outliers]))][:top]:
+            group = result['groups'][i]
+            print(f"{names[i]:<20}{ids[i]:>6}  {data['pin37'][i]:02d}H--{data['pin44'][i]:02d}H   "
+                  f"{display(test, data['value'][i]):>12}{display(test, result['median'][group]):>12}{result['z'][i]:>8.1f}")
+
+    drifting = np.flatnonzero(np.abs(result['t']) >= trendT)
+    if len(drifting) > 0:
+        print(f"\n{'channel':<12}{'tests':>7}{'median':>12}{'drift':>8}{'t':>8}  (drift: spread over the time span)")
+        for group in drifting[np.argsort(-np.abs(result['t'][drifting]))][:top]:
+            pin44, pin37 = result['keys'][group] // 1000 % 1000, result['keys'][group] % 1000
+            print(f"{pin37:02d}H--{pin44:02d}H   {result['population'][group]:>7}"
+                  f"{display(test, result['median'][group]):>12}{result['drift'][group]:>+8.1f}{result['t'][group]:>+8.1f}")
+
+
+def mappingWires(paths):
+    # Continuity wires of each mapping file, to find the mapping of an imported report
+    wires = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as file:
+            content = file.read()
+        pairs = set()
+        for i, row in enumerate(csv.reader(content.decode().splitlines(), delimiter=',')):
+            if i == 0 or len(row) < 4 or row[0] == '':
+                continue
+            pin44, pin37A, pin37B = [int(col.replace("CH", "").replace("Ch", "").replace("H", "")) for col in (row[0], row[2], row[3])]
+            pairs |= {(pin44, pin37A), (pin44, pin37B)}
+        wires[os.path.basename(path)] = (hashlib.sha256(content).hexdigest(), pairs)
+    return wires
+
+
+def parseReport(path):
+    # Test, cable, time, verdict, error and wires of a Continuity and Load or Hi-Pot text report
+    with open(path, 'r') as file:
+        lines = file.read().splitlines()
+    test = 'Cont. Load' if 'Continuity' in lines[0] else 'HiPot'
+    time = datetime.strptime(lines[2], '%Y/%m/%d %H:%M:%S').isoformat()
+    passed = any(line.startswith('---> ') and 'PASSED' in line for line in lines)
+    error = None
+    wires = []
+    row = None
+    baseline = None
+    for n, line in enumerate(lines):
+        m = rowPattern.match(line)
+        if m is not None:
+            row = int(m.group(1))
+            continue
+        if line.startswith('---> ') and 'FAILED' in line and row is None:
+            error = next((following for following in lines[n + 1:] if following != ''), 'FAILED')
+            break
+        m = baselinePattern.match(line)
+        if m is not None:
+            baseline = (m.group(2) == 'OK', [float(m.group(3)), float(m.group(4))])
+            continue
+        if test == 'Cont. Load':
+            m = continuityPattern.match(line)
+            if m is not None:
+                pin37, pin44, valid, r, voltage1, voltage2 = m.groups()
+                r = float(EngNumber(r))
+                voltages = baseline[1] + [float(voltage1), float(voltage2)]
+                wires.append([row, int(pin44), int(pin37), None, json.dumps(voltages), r, None, None, None,
+                              valid == 'OK' and baseline[0]])
+        else:
+            m = hiPotPattern.match(line)
+            if m is not None:
+                pin37A, pin37B, pin44, valid, r, leakage, voltage1, voltage2 = m.groups()
+                wires.append([row, int(pin44), int(pin37A), int(pin37B), json.dumps([float(voltage1), float(voltage2)]),
+                              float(EngNumber(r)) if r is not None else None,
+                              float(EngNumber(leakage)) if leakage is not None else None, None, None, valid == 'OK'])
+    return {'test': test, 'name': lines[1], 'time': time, 'passed': passed, 'error': error, 'wires': wires,
+            'report': path}
+
+
+def importReports(db, directory, jobs, mappingFiles):
+    # Parse the reports not in the store yet in parallel and save each one as a test
+    known = set()
+    for (reports,) in db.execute('SELECT reports FROM tests'):
+        known |= set(os.path.basename(report) for report in json.loads(reports or '[]'))
+    paths = [path for path in sorted(glob.glob(os.path.join(directory, 'continuity_load_*.txt')) +
+                                     glob.glob(os.path.join(directory, 'hi_pot_2*.txt')))
+             if os.path.basename(path) not in known]
+    wires = mappingWires(mappingFiles)
+
+    imported = 0
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        for report in executor.map(parseReport, paths, chunksize=16):
+            pairs = set((wire[1], wire[2]) for wire in report['wires'])
+            # The smallest mapping holding all the wires of the report
+            mapping, mappingHash = None, None
+            candidates = [(len(mappingPairs), name, digest) for name, (digest, mappingPairs) in wires.items()
+                          if len(pairs) > 0 and pairs <= mappingPairs]
+            if len(candidates) > 0:
+                mapping, mappingHash = min(candidates)[1:]
+            vacFeedTester.insertTest(db, (report['test'], report['name'], mapping, mappingHash, report['time'], None,
+                                          report['passed'], report['error'], None, json.dumps([report['report']])),
+                                     report['wires'])
+            imported += 1
+    print(f"{imported} reports imported from {directory}, {len(known)} already in the results store")
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', dest='db', default='reports/results.db', help='Results store written by vacFeedTester.py (DEFAULT: reports/results.db)')
+    parser.add_argument('--import-reports', dest='importReports', help='Import the Continuity and Load and Hi-Pot text reports of this directory first')
+    parser.add_argument('--jobs', dest='jobs', type=int, help='Processes parsing the imported reports (DEFAULT: one per CPU)')
+    parser.add_argument('-m', dest='mappings', action='append', help='Mapping csv file the imported reports can come from, can be repeated (DEFAULT: science and corner raft mappings)')
+    parser.add_argument('--test', dest='tests', action='append', choices=['continuity', 'hipot'], help='Test to analyze, can be repeated (DEFAULT: both)')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=5, help='Robust z-score from which a passing wire is listed (DEFAULT: 5)')
+    parser.add_argument('--min-count', dest='minCount', type=int, default=10, help='Measurements of a channel needed to judge its wires and trend (DEFAULT: 10)')
+    parser.add_argument('--trend-t', dest='trendT', type=float, default=4, help='t-statistic of its trend from which a channel is listed as drifting (DEFAULT: 4)')
+    parser.add_argument('--top', dest='top', type=int, default=20, help='Lines of each list (DEFAULT: 20)')
+    return parser.parse_args(args[1:])
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv)
+    db = vacFeedTester.openStore(args.db)
+    if args.importReports is not None:
+        here = os.path.dirname(os.path.abspath(__file__))
+        importReports(db, args.importReports, args.jobs, args.mappings or [os.path.join(here, m) for m in mappings])
+
+    for test in args.tests or ['continuity', 'hipot']:
+        test = {'continuity': 'Cont. Load', 'hipot': 'HiPot'}[test]
+        data = loadValues(db, test)
+        if data is None:
+            print(f"\n{test}: no results")
+            continue
+        printAnalysis(test, analyze(data, args.threshold, args.minCount), args.top, args.trendT)
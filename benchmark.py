@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# Runs the tests against the simulated 3700A (keithleySim.py) and reports the instrument traffic and the time
+# each test would spend on the bench, split between the network and the instrument itself. A test can also run
+# against a transcript recorded on the bench with vacFeedTester.py --record, for the traffic and the time the
+# tester itself takes.
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import keithleySim
+import vacFeedTester
+
+
+mappings = ['science_raft_channel_mapping.csv', 'corner_raft_channel_mapping.csv']
+tests = ['continuity', 'hipot', 'pinout']
+
+# vacFeedTester options of each variant
+variants = {
+    'default': {},
+    'coalesce': {'coalesce': True},
+    'track-relays': {'trackRelays': True},
+    'plan': {'trackRelays': True, 'plan': True},
+    'instrument': {'tsp': True, 'scan': True},
+    'groups': {'groups': True},
+    'screen': {'screen': 0.2},
+    'bridge': {'bridge': True},
+    'error-phase': {'errorCheck': 'phase'},
+    'fast': {'coalesce': True, 'trackRelays': True, 'errorCheck': 'phase', 'tsp': True, 'groups': True,
+             'screen': 0.2},
+}
+
+# Results compared against the baseline, lower is better
+metrics = ['writes', 'asks', 'bytesOut', 'bytesIn', 'relayOps', 'readings', 'network', 'measurement', 'total']
+
+
+def replayedCalls(calls):
+    # Traffic of the replayed transcript calls, as counted by the simulator
+    stats = {'writes': 0, 'asks': 0, 'stb': 0, 'bytesOut': 0, 'bytesIn': 0}
+    for call in calls:
+        if 'w' in call:
+            stats['writes'] += 1
+            stats['bytesOut'] += len(call['w'])
+        elif 'a' in call:
+            stats['asks'] += 1
+            stats['bytesOut'] += len(call['a'])
+            stats['bytesIn'] += len(call['r'])
+        else:
+            stats['stb'] += 1
+    return stats
+
+
+def benchmark(mapping, test, variant, faults=(), latencies=None, replay=None):
+    # With replay, the test runs against that transcript of a vacFeedTester.py run of this test, mapping and
+    # variant, after the preConfiguration() of the run. The relay operations, readings and instrument times are
+    # unknown then
+    options = variants[variant]
+    vacFeedTester.readCsv(mapping)
+    vacFeedTester.errorCheck = options.get('errorCheck', 'reading')
+    vacFeedTester.relayTracking = options.get('trackRelays', False)
+    vacFeedTester.relayVerify = 'phase'
+    vacFeedTester.name = 'benchmark'
+    if replay is not None:
+        vacFeedTester.connect(None, options.get('coalesce', False), replay=replay)
+        replayed = vacFeedTester.instr
+        while isinstance(replayed, vacFeedTester.InstrumentWrapper):
+            replayed = replayed.instrument
+        vacFeedTester.preConfiguration()
+        first = replayed.position
+    else:
+        vacFeedTester.connect(None, options.get('coalesce', False),
+                              {'mapping': mapping, 'faults': list(faults), 'latencies': latencies})
+    simulator = vacFeedTester.simulator
+
+    start = time.perf_counter()
+    try:
+        passed = vacFeedTester.runTest(test, options)
+    finally:
+        vacFeedTester.instr.close()
+        wall = time.perf_counter() - start
+        vacFeedTester.instr = None
+        vacFeedTester.simulator = None
+        del vacFeedTester.uncheckedReadings[:]
+
+    result = {'mapping': os.path.basename(mapping), 'test': test, 'variant': variant, 'passed': passed}
+    if replay is not None:
+        result.update(replayedCalls(replayed.calls[first:replayed.position]))
+        result.update(relayOps=None, readings=None, statements=None, network=None, measurement=None, total=None)
+    else:
+        result.update(simulator.stats)
+        result['network'] = simulator.networkTime
+        result['measurement'] = simulator.instrumentTime
+        result['total'] = simulator.networkTime + simulator.instrumentTime
+    result['wall'] = wall
+    return result
+
+
+def key(result):
+    return (result['mapping'], result['test'], result['variant'])
+
+
+def printResults(results):
+    # The metrics a replay doesn't know are printed as -
+    def seconds(value, width):
+        return f"{value:>{width - 1}.2f}s" if value is not None else f"{'-':>{width}}"
+
+    print(f"{'mapping':<34}{'test':<12}{'variant':<14}{'pass':>5}{'writes':>8}{'asks':>6}{'relays':>8}"
+          f"{'readings':>9}{'network':>9}{'meas.':>8}{'total':>8}{'wall':>7}")
+    for r in results:
+        print(f"{r['mapping']:<34}{r['test']:<12}{r['variant']:<14}{'yes' if r['passed'] else 'no':>5}"
+              f"{r['writes']:>8}{r['asks']:>6}{'-' if r['relayOps'] is None else r['relayOps']:>8}"
+              f"{'-' if r['readings'] is None else r['readings']:>9}"
+              f"{seconds(r['network'], 9)}{seconds(r['measurement'], 8)}{seconds(r['total'], 8)}{seconds(r['wall'], 7)}")
+
+
+def compare(results, baseline, threshold):
+    # Print the changes from the baseline, returns the number of metrics worse by more than threshold
+    previous = {key(r): r for r in baseline}
+    regressions = 0
+    for r in results:
+        old = previous.get(key(r))
+        if old is None:
+            print(f"{' '.join(key(r))}: not in the baseline")
+            continue
+        changes = []
+        if r['passed'] != old['passed']:
+            changes.append(f"passed {old['passed']} -> {r['passed']}")
+            regressions += 1
+        for metric in metrics:
+            if old[metric] == r[metric] or old[metric] is None or r[metric] is None:
+                continue
+            change = (r[metric] - old[metric]) / old[metric] if old[metric] != 0 else float('inf')
+            flag = ''
+            if change > threshold:
+                flag = ' REGRESSION'
+                regressions += 1
+            changes.append(f"{metric} {old[metric]:.6g} -> {r[metric]:.6g} ({change:+.1%}){flag}")
+        print(f"{' '.join(key(r))}: " + (', '.join(changes) if len(changes) > 0 else 'unchanged'))
+    return regressions
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', dest='mappings', action='append', help='Channels mapping csv file, can be repeated (DEFAULT: science and corner raft mappings)')
+    parser.add_argument('--test', dest='tests', action='append', choices=tests, help='Test to run, can be repeated (DEFAULT: all)')
+    parser.add_argument('--variant', dest='variants', action='append', choices=list(variants), help='Tester options to run with, can be repeated (DEFAULT: default)')
+    parser.add_argument('--faults', dest='faults', default='', help='Comma separated faults of the simulated feedthrough, see keithleySim.py')
+    parser.add_argument('--latency', dest='latency', help='Comma separated KIND=SECONDS simulated latencies, KIND in ' + ', '.join(keithleySim.latency))
+    parser.add_argument('--replay', dest='replay', help='Run the test against this transcript of a vacFeedTester.py --record run of a single test, with one -m, --test and --variant, those of the recorded run (DEFAULT: science raft mapping, default variant)')
+    parser.add_argument('-o', dest='output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', dest='baseline', help='Compare the results with this JSON file, exit with 1 on regressions')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.02, help='Relative increase of a metric reported as a regression (DEFAULT: 0.02)')
+    parsed = parser.parse_args(args[1:])
+    if parsed.replay is not None and (len(parsed.mappings or []) > 1 or len(parsed.tests or []) != 1 or len(parsed.variants or []) > 1):
+        parser.error('--replay runs the single mapping, test and variant of the recorded run')
+    return parsed
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv)
+    here = os.path.dirname(os.path.abspath(__file__))
+    files = [os.path.abspath(m) for m in args.mappings] if args.mappings else [os.path.join(here, m) for m in mappings]
+    replay = os.path.abspath(args.replay) if args.replay is not None else None
+    if replay is not None:
+        files = files[:1]
+    faults = [fault for fault in args.faults.split(',') if fault != '']
+    latencies = keithleySim.parseLatencies(args.latency) if args.latency is not None else None
+
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as reports:
+        # The tests write their reports in the reports directory of the current directory
+        os.chdir(reports)
+        os.makedirs('reports')
+        try:
+            for mapping in files:
+                for test in args.tests or tests:
+                    for variant in args.variants or ['default']:
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            results.append(benchmark(mapping, test, variant, faults, latencies, replay))
+        finally:
+            os.chdir(cwd)
+
+    printResults(results)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({'faults': faults, 'latencies': latencies, 'replay': args.replay, 'results': results}, file, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)['results']
+        print()
+        if compare(results, baseline, args.threshold) > 0:
+            sys.exit(1)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# Runs test jobs on several 3700A stations at the same time. vacFeedTester.py keeps its instrument, mapping and
+# cable name in module globals, so each station gets its own process running its jobs one after the other.
+# The stations send their progress and test results to a single queue, shown and saved by the main process.
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from datetime import datetime
+
+import vacFeedTester
+
+
+mappings = {'science': 'science_raft_channel_mapping.csv', 'corner': 'corner_raft_channel_mapping.csv'}
+
+
+def readJobs(filePath):
+    # One job per line: ip, cable name, mapping (science, corner or a csv file) and tests joined with '+'
+    # (hipot, continuity, pinout)
+    jobs = []
+    with open(filePath, 'r') as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+        for row in reader:
+            if len(row) == 0 or row[0].strip() == '' or row[0].startswith('#'):
+                continue
+            ip, name, mapping, tests = [col.strip() for col in row[:4]]
+            tests = tests.split('+')
+            for test in tests:
+                if test not in vacFeedTester.JobRunner.tests:
+                    raise ValueError(f"{filePath}: unknown test {test} for {name}")
+            jobs.append({'ip': ip, 'name': name, 'mapping': mappings.get(mapping, mapping), 'tests': tests})
+    return jobs
+
+
+def station(ip, jobs, options, results, livePort=None):
+    # Run the jobs of one station in a single instrument session, in a process of its own. The test output
+    # goes to the station log in the reports directory, and to the live dashboard on livePort if any
+    if not os.path.exists('reports'):
+        os.makedirs('reports')
+    sys.stdout = open(f"reports/fleet_{ip.replace(':', '_')}.log", 'w')
+    vacFeedTester.errorCheck = options['errorCheck']
+    vacFeedTester.relayTracking = options['trackRelays']
+    vacFeedTester.relayVerify = options['verifyRelays']
+    vacFeedTester.resultsDb = options['resultsDb']
+    if livePort is not None:
+        vacFeedTester.startLive(options['liveHost'], livePort)
+
+    current = {}
+    vacFeedTester.listeners.append(lambda record: results.put(dict(record, kind='test', ip=ip, job=current['name'])))
+    try:
+        simulation = None
+        if options['transport'] == 'sim':
+            simulation = {'mapping': jobs[0]['mapping'], 'faults': options['faults']}
+        vacFeedTester.connect(ip, options['coalesce'], simulation, link=options['transport'])
+        vacFeedTester.preConfiguration()
+        configured = True
+        for job in jobs:
+            current['name'] = job['name']
+            results.put({'kind': 'start', 'ip': ip, 'job': job['name']})
+            error = None
+            try:
+                if not configured:
+                    vacFeedTester.preConfiguration()
+                    configured = True
+                vacFeedTester.readCsv(job['mapping'])
+                vacFeedTester.name = job['name']
+                session = datetime.now()
+                for test in job['tests']:
+                    vacFeedTester.runTest(test, options, session)
+            except Exception as e:
+                error = repr(e)
+                configured = False
+            results.put({'kind': 'finish', 'ip': ip, 'job': job['name'], 'error': error})
+    except Exception as e:
+        results.put({'kind': 'station', 'ip': ip, 'error': repr(e)})
+    finally:
+        if vacFeedTester.instr is not None:
+            vacFeedTester.instr.close()
+        sys.stdout.flush()
+        results.put({'kind': 'done', 'ip': ip})
+
+
+def progress(record, done, total):
+    if record['kind'] == 'start':
+        return f"[{record['ip']}] {record['job']}: started"
+    if record['kind'] == 'test':
+        verdict = 'PASSED' if record['passed'] else f"FAILED ({len(record['bad'])} bad)"
+        if record['error'] is not None:
+            verdict = f"FAILED ({record['error']})"
+        return f"[{record['ip']}] {record['job']}: {record['test']} {verdict}"
+    if record['kind'] == 'finish':
+        status = 'finished' if record['error'] is None else f"error {record['error']}"
+        return f"[{record['ip']}] {record['job']}: {status} ({done} of {total} jobs done)"
+    if record['kind'] == 'station':
+        return f"[{record['ip']}] station error {record['error']}"
+    return None
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('jobs', help='Jobs csv file: ip, cable name, mapping (science, corner or a csv file), tests joined with + (hipot, continuity, pinout)')
+    parser.add_argument('-o', dest='output', help='Write the test results to this JSON file (DEFAULT: reports/fleet_<date>.json)')
+    parser.add_argument('--results-db', dest='resultsDb', help='SQLite database the stations save the test results to (DEFAULT: reports/results.db, none with --transport sim)')
+    parser.add_argument('--live', dest='live', type=int, help='Serve a live dashboard of each station, on ports LIVE, LIVE + 1... in the order of the jobs file')
+    parser.add_argument('--live-host', dest='liveHost', default='127.0.0.1', help='Address the --live HTTP servers listen on (DEFAULT: 127.0.0.1)')
+    parser.add_argument('--transport', dest='transport', choices=['vxi11', 'socket', 'sim'], default='vxi11', help='Connection to the stations (DEFAULT: vxi11)')
+    parser.add_argument('--sim-faults', dest='simFaults', default='', help='Comma separated faults of the simulated feedthroughs, see keithleySim.py')
+    parser.add_argument('--coalesce', dest='coalesce', help='Send consecutive commands to the instrument as a single message', action="store_true")
+    parser.add_argument('--error-check', dest='errorCheck', choices=['reading', 'row', 'phase', 'status'], default='reading', help='When the instrument error queue is checked (DEFAULT: reading)')
+    parser.add_argument('--track-relays', dest='trackRelays', help='Keep track of the relay states and only send the operations that change them', action="store_true")
+    parser.add_argument('--verify-relays', dest='verifyRelays', choices=['never', 'row', 'phase'], default='phase', help='Check the tracked relay states against the instrument after each row or phase (DEFAULT: phase)')
+    for option in vacFeedTester.JobRunner.options:
+        if option == 'screen':
+            parser.add_argument('--screen', dest='screen', type=float, help='Continuity and Load screening margin, see vacFeedTester.py')
+        else:
+            parser.add_argument(f'--{option}', dest=option, help=f'Run the tests with --{option}, see vacFeedTester.py', action="store_true")
+    return parser.parse_args(args[1:])
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv)
+    jobs = readJobs(args.jobs)
+    options = vars(args)
+    options['faults'] = [fault for fault in args.simFaults.split(',') if fault != '']
+    if args.resultsDb is None and args.transport != 'sim':
+        options['resultsDb'] = 'reports/results.db'
+
+    stations = {}
+    for job in jobs:
+        stations.setdefault(job['ip'], []).append(job)
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=station, args=(ip, stationJobs, options, results,
+                                                               args.live + n if args.live is not None else None))
+                 for n, (ip, stationJobs) in enumerate(stations.items())]
+    start = time.monotonic()
+    for process in processes:
+        process.start()
+    print(f"{len(jobs)} jobs on {len(stations)} stations")
+    if args.live is not None:
+        for n, ip in enumerate(stations):
+            print(f"    {ip}: http://{args.liveHost}:{args.live + n}/")
+
+    records = []
+    done = 0
+    running = len(processes)
+    try:
+        while running > 0:
+            try:
+                record = results.get(timeout=1)
+            except queue.Empty:
+                # A station process that died without reporting
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            if record['kind'] == 'done':
+                running -= 1
+                continue
+            if record['kind'] == 'finish':
+                done += 1
+            records.append(record)
+            print(progress(record, done, len(jobs)))
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+    for process in processes:
+        process.join()
+
+    tests = [record for record in records if record['kind'] == 'test']
+    failed = [record for record in tests if not record['passed']]
+    errors = [record for record in records if record.get('error') is not None and record['kind'] != 'test']
+    print(f"\n{done} of {len(jobs)} jobs done in {time.monotonic() - start:.1f}s: {len(tests) - len(failed)} tests passed, "
+          f"{len(failed)} failed, {len(errors)} errors")
+    for record in failed:
+        print(f"    FAILED [{record['ip']}] {record['job']}: {record['test']}")
+
+    if not os.path.exists('reports'):
+        os.makedirs('reports')
+    output = args.output or datetime.now().strftime('reports/fleet_%Y_%m_%d_%Hh%Mm%Ss.json')
+    with open(output, 'w') as file:
+        json.dump(records, file, indent=4)
+    print(f"Results saved to {output}")
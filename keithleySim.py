@@ -0,0 +1,727 @@
+#!/usr/bin/env python
+# Simulated Keithley 3700A with two 3722 cards on slots 1 and 2, wired to the test boards and a vacuum
+# feedthrough built from a channels mapping csv file. It runs the subset of TSP used by vacFeedTester.py and
+# accounts the time each operation would take on the real instrument.
+import argparse
+import csv
+import json
+import math
+import os
+import random
+import re
+import socketserver
+import threading
+import sys
+import time
+
+
+# Test fixture seen by the 3700A. Values are what the real boards measure, not the nominal ones hard-coded
+# in vacFeedTester.py, so self-calibrating code paths have something to find.
+fixture = {
+    'v5': 5.02,  # Continuity supply in volts
+    'v250': 249.2,  # Hi-Pot supply in volts
+    'R37': 5.27,  # Continuity load resistor on Test Board 1 in ohms
+    'R44': 10.41,  # Continuity load resistor on Test Board 2 in ohms
+    'Rtest': 100000,  # Hi-Pot series resistor in ohms
+    'wireR': 0.35,  # Healthy feedthrough wire resistance in ohms
+    'pinR': 1e6,  # Source impedance of powered pins during the pinout test in ohms
+}
+
+# Default per-operation latencies in seconds
+latency = {
+    'write': 0.002,  # VXI-11 round trip for a write
+    'ask': 0.004,  # VXI-11 round trip for a query (write + read)
+    'stb': 0.001,  # VXI-11 device_readstb
+    'relay': 0.004,  # 3722 relay actuation and settling
+    'autodelay': 0.002,  # DMM autodelay applied once per configuration change
+    'statement': 0.00002,  # TSP statement parsing and execution
+    'reset': 0.5,  # reset() of the instrument, its relays opened aside
+}
+
+constants = {
+    'dmm.ON': 1, 'dmm.OFF': 0,
+    'dmm.CONNECT_TWO_WIRE': 2, 'dmm.CONNECT_FOUR_WIRE': 4,
+    'dmm.AUTODELAY_OFF': 0, 'dmm.AUTODELAY_ONCE': 1,
+    'dmm.FILTER_REPEAT_AVG': 0, 'dmm.FILTER_MOVING_AVG': 1,
+    'channel.BREAK_BEFORE_MAKE': 1, 'channel.MAKE_BEFORE_BREAK': 2, 'channel.OFF': 0,
+    'scan.MODE_OPEN_ALL': 0, 'scan.MODE_OPEN_SELECTIVE': 1, 'scan.MODE_FIXED_ABR': 2,
+}
+
+dmmDefaults = {
+    'func': 'dcvolts', 'range': 300, 'autorange': 1, 'nplc': 1, 'autodelay': 1, 'connect': 2,
+    'filter.count': 10, 'filter.type': 0, 'filter.enable': 0,
+}
+
+dcvRanges = [0.1, 1, 10, 100, 300]
+ohmRanges = [1, 10, 100, 1e3, 10e3, 100e3, 1e6, 10e6, 100e6]
+ohmCurrent = 1e-3 # Two wire ohms test current in amps, the source voltages seen by the DMM add to the reading
+
+GND = 'gnd'
+V5 = 'v5'
+V250 = 'v250'
+DMM = 'dmm'
+
+
+class TspError(Exception):
+    pass
+
+
+class Buffer:
+    def __init__(self, size):
+        self.size = size
+        self.readings = []
+
+
+def readMapping(filePath):
+    rows = []
+    with open(filePath, 'r') as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+        for i, row in enumerate(reader):
+            if i == 0 or row[0] == '':
+                continue
+            channelRow = [row[0], row[2], row[3], row[5]]
+            for n, col in enumerate(channelRow):
+                channelRow[n] = int(col.replace("CH", "").replace("Ch", "").replace("H", ""))
+            rows.append(channelRow)
+    return rows
+
+
+def parseFault(spec):
+    # open:<pin37>               Open wire between a 37 pins channel and its 44 pins channel
+    # res:<pin37>:<ohms>         Wire resistance for a 37 pins channel
+    # leak:<pin44>:<pin37>:<ohms>  Leakage between a 44 pins channel net and a 37 pins channel
+    # leak:<pin44>:gnd:<ohms>    Leakage between a 44 pins channel net and ground
+    parts = spec.split(':')
+    kind = parts[0]
+    if kind == 'open' and len(parts) == 2:
+        return ('res', int(parts[1]), math.inf)
+    if kind == 'res' and len(parts) == 3:
+        return ('res', int(parts[1]), float(parts[2]))
+    if kind == 'leak' and len(parts) == 4:
+        other = GND if parts[2] == 'gnd' else ('37', int(parts[2]))
+        return ('leak', ('44', int(parts[1])), other, float(parts[3]))
+    raise ValueError(f"Invalid fault specification: {spec}")
+
+
+def parseLatencies(spec):
+    # <kind>=<seconds>[,<kind>=<seconds>...] with the kinds of the latency table, or a JSON file of a
+    # {"<kind>": <seconds>} object, for instance the latencies measured on an instrument
+    if os.path.isfile(spec):
+        with open(spec, 'r') as file:
+            latencies = json.load(file)
+        for kind, seconds in latencies.items():
+            if kind not in latency or not isinstance(seconds, (int, float)):
+                raise ValueError(f"Invalid latency in {spec}: {kind}")
+        return {kind: float(seconds) for kind, seconds in latencies.items()}
+    latencies = {}
+    for item in spec.split(','):
+        kind, _, seconds = item.partition('=')
+        if kind not in latency or seconds == '':
+            raise ValueError(f"Invalid latency specification: {item}")
+        latencies[kind] = float(seconds)
+    return latencies
+
+
+def tokenize(line):
+    tokens = []
+    pos = 0
+    pattern = re.compile(r'\s*(?:(--.*)|("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')|'
+                         r'(-?\d+\.?\d*(?:[eE][-+]?\d+)?)|([A-Za-z_][\w]*(?:\.[A-Za-z_][\w]*)*)|([(),=]))')
+    while pos < len(line):
+        if line[pos:].strip() == '':
+            break
+        m = pattern.match(line, pos)
+        if m is None:
+            raise TspError(f"unexpected symbol near '{line[pos:pos + 10].strip()}'")
+        pos = m.end()
+        comment, string, number, name, punct = m.groups()
+        if comment is not None:
+            break
+        if string is not None:
+            tokens.append(('str', string[1:-1]))
+        elif number is not None:
+            tokens.append(('num', float(number)))
+        elif name is not None:
+            tokens.append(('name', name))
+        else:
+            tokens.append(('op', punct))
+    return tokens
+
+
+class SimulatedInstrument:
+    def __init__(self, mapping=None, faults=(), latencies=None, realtime=False, seed=0, **fixtureValues):
+        self.fixture = dict(fixture)
+        self.fixture.update(fixtureValues)
+        self.latency = dict(latency)
+        if latencies is not None:
+            self.latency.update(latencies)
+        self.realtime = realtime
+        self.random = random.Random(seed)
+        self.timeout = 10
+
+        self.rows = readMapping(mapping) if mapping is not None else []
+        self.wires = {}
+        self.leaks = []
+        self.pinVoltages = {}
+        for pin44, pin37A, pin37B, expected in self.rows:
+            self.wires[pin37A] = (pin44, self.fixture['wireR'])
+            self.wires[pin37B] = (pin44, self.fixture['wireR'])
+            if expected != 0:
+                self.pinVoltages[pin37A] = expected
+                self.pinVoltages[pin37B] = expected
+        for spec in faults:
+            fault = parseFault(spec) if isinstance(spec, str) else spec
+            if fault[0] == 'res':
+                pin44, _ = self.wires[fault[1]]
+                self.wires[fault[1]] = (pin44, fault[2])
+            else:
+                self.leaks.append(fault[1:])
+
+        self.stats = {'writes': 0, 'asks': 0, 'stb': 0, 'bytesOut': 0, 'bytesIn': 0, 'relayOps': 0,
+                      'readings': 0, 'statements': 0}
+        self.networkTime = 0.0
+        self.instrumentTime = 0.0
+        self.times = {} # Simulated seconds by kind: the latency table kinds, 'reading', 'delay' and 'beep'
+        self.scripts = {}
+        self.loading = None
+        self.variables = {}
+        self.errors = []
+        self.display = ['', '']
+        self.cursor = 1
+        self.reset()
+
+    # Transport side
+
+    def write(self, message):
+        self.stats['writes'] += 1
+        self.stats['bytesOut'] += len(message)
+        self.spend('write', network=True)
+        self.execute(message)
+
+    def ask(self, message):
+        self.stats['asks'] += 1
+        self.stats['bytesOut'] += len(message)
+        self.spend('ask', network=True)
+        output = self.execute(message)
+        response = '\n'.join(output)
+        self.stats['bytesIn'] += len(response)
+        return response
+
+    def read_stb(self):
+        self.stats['stb'] += 1
+        self.spend('stb', network=True)
+        stb = 0
+        if len(self.errors) > 0:
+            stb |= 4
+        return stb
+
+    def close(self):
+        pass
+
+    def receive(self, message):
+        # A message from the raw socket server: queries are the messages that print something
+        output = self.execute(message)
+        kind = 'asks' if len(output) > 0 else 'writes'
+        self.stats[kind] += 1
+        self.stats['bytesOut'] += len(message)
+        self.spend(kind[:-1], network=True)
+        response = '\n'.join(output)
+        self.stats['bytesIn'] += len(response)
+        return output
+
+    def summary(self):
+        return (f"Simulated 3700A: {self.stats['writes']} writes, {self.stats['asks']} queries, "
+                f"{self.stats['relayOps']} relay operations, {self.stats['readings']} readings, "
+                f"{self.networkTime:.2f}s network, {self.instrumentTime:.2f}s instrument")
+
+    def spend(self, kind, count=1, network=False):
+        self.elapse(kind, self.latency[kind] * count, network)
+
+    def elapse(self, kind, seconds, network=False, sleep=True):
+        self.times[kind] = self.times.get(kind, 0.0) + seconds
+        if network:
+            self.networkTime += seconds
+        else:
+            self.instrumentTime += seconds
+        if self.realtime and sleep and seconds > 0:
+            time.sleep(seconds)
+
+    # TSP side
+
+    def reset(self):
+        self.closed = set()
+        self.patterns = {}
+        self.dmm = dict(dmmDefaults)
+        self.dmmConfigs = {}
+        self.autodelayPending = True
+        self.scanList = []
+        self.scanMode = 0
+        self.connectRule = 1
+        self.beeperEnable = 1
+
+    def execute(self, message):
+        output = []
+        for line in message.split('\n'):
+            stripped = line.strip()
+            if self.loading is not None:
+                if stripped == 'endscript':
+                    name, lines = self.loading
+                    self.scripts[name] = lines
+                    self.loading = None
+                else:
+                    self.loading[1].append(line)
+                continue
+            if stripped.startswith('loadscript'):
+                self.loading = (stripped.split()[1], [])
+                continue
+            try:
+                self.run(tokenize(line), output)
+            except TspError as e:
+                self.errors.append((-285, f"TSP Syntax error at line 1: {e}"))
+        return output
+
+    def run(self, tokens, output):
+        while len(tokens) > 0:
+            tokens = self.statement(tokens, output)
+
+    def statement(self, tokens, output):
+        self.stats['statements'] += 1
+        self.spend('statement')
+        if tokens[0] == ('name', 'local'):
+            tokens = tokens[1:]
+        kind, name = tokens[0]
+        if kind != 'name':
+            raise TspError(f"unexpected symbol near '{name}'")
+        if len(tokens) > 1 and tokens[1] == ('op', '='):
+            value, rest = self.expression(tokens[2:], output)
+            self.assign(name, value)
+            return rest
+        if len(tokens) > 1 and tokens[1] == ('op', '('):
+            args, rest = self.arguments(tokens[2:], output)
+            self.call(name, args, output)
+            return rest
+        raise TspError(f"syntax error near '{name}'")
+
+    def arguments(self, tokens, output):
+        args = []
+        if tokens[0] == ('op', ')'):
+            return args, tokens[1:]
+        while True:
+            value, tokens = self.expression(tokens, output)
+            args.append(value)
+            if len(tokens) == 0:
+                raise TspError("')' expected")
+            if tokens[0] == ('op', ')'):
+                return args, tokens[1:]
+            if tokens[0] != ('op', ','):
+                raise TspError("')' expected")
+            tokens = tokens[1:]
+
+    def expression(self, tokens, output):
+        if len(tokens) == 0:
+            raise TspError("unexpected symbol near <eof>")
+        kind, value = tokens[0]
+        if kind in ('num', 'str'):
+            return value, tokens[1:]
+        if kind != 'name':
+            raise TspError(f"unexpected symbol near '{value}'")
+        if len(tokens) > 1 and tokens[1] == ('op', '('):
+            args, rest = self.arguments(tokens[2:], output)
+            return self.call(value, args, output), rest
+        return self.lookup(value), tokens[1:]
+
+    def lookup(self, name):
+        if name in constants:
+            return constants[name]
+        if name in self.variables:
+            return self.variables[name]
+        base, _, attribute = name.rpartition('.')
+        if base in self.variables and attribute == 'n':
+            return len(self.variables[base].readings)
+        if name == 'errorqueue.count':
+            return len(self.errors)
+        if name == 'status.condition':
+            return 4 if len(self.errors) > 0 else 0
+        if name.startswith('dmm.') and name[4:] in self.dmm:
+            return self.dmm[name[4:]]
+        if name in ('true', 'false', 'nil'):
+            return {'true': True, 'false': False, 'nil': None}[name]
+        raise TspError(f"attempt to index a nil value ({name})")
+
+    def assign(self, name, value):
+        if name.startswith('dmm.') and name[4:] in self.dmm:
+            if self.dmm[name[4:]] != value:
+                self.autodelayPending = True
+            self.dmm[name[4:]] = value
+            if name == 'dmm.range':
+                self.dmm['autorange'] = 0
+        elif name == 'channel.connectrule':
+            self.connectRule = value
+        elif name == 'beeper.enable':
+            self.beeperEnable = value
+        elif name == 'scan.mode':
+            self.scanMode = value
+        elif '.' in name:
+            raise TspError(f"attempt to index a nil value ({name})")
+        else:
+            self.variables[name] = value
+
+    def call(self, name, args, output):
+        if name == 'print':
+            output.append('\t'.join(self.format(a) for a in args))
+        elif name == 'printbuffer':
+            start, end, buf = int(args[0]), int(args[1]), args[2]
+            output.append(', '.join(f"{v:.9e}" for v in buf.readings[start - 1:end]))
+        elif name == 'reset':
+            self.spend('reset')
+            self.relays(sorted(self.closed), close=False)
+            self.reset()
+        elif name == 'delay':
+            self.elapse('delay', args[0])
+        elif name == 'channel.close':
+            self.relays(self.channels(args[0]), close=True)
+        elif name == 'channel.open':
+            self.relays(self.channels(args[0]), close=False)
+        elif name == 'channel.getclose':
+            closed = [str(ch) for ch in sorted(self.closed)]
+            return ';'.join(closed) if len(closed) > 0 else None
+        elif name == 'channel.pattern.setimage':
+            self.patterns[args[1]] = self.channels(args[0])
+        elif name == 'channel.pattern.delete':
+            self.patterns.pop(args[0], None)
+        elif name == 'dmm.measure':
+            value = self.measure()
+            if len(args) > 0:
+                args[0].readings.append(value)
+            return value
+        elif name == 'dmm.makebuffer':
+            return Buffer(int(args[0]))
+        elif name == 'dmm.configure.set':
+            self.dmmConfigs[args[0]] = dict(self.dmm)
+        elif name == 'dmm.reset':
+            self.dmm = dict(dmmDefaults)
+            self.autodelayPending = True
+        elif name == 'scan.reset':
+            self.scanList = []
+        elif name in ('scan.create', 'scan.add'):
+            if name == 'scan.create':
+                self.scanList = []
+            if len(args) > 0:
+                for ch in args[0].split(','):
+                    self.scanList.append((ch.strip(), args[1] if len(args) > 1 else None))
+        elif name == 'scan.execute':
+            self.scan(args[0])
+        elif name == 'errorqueue.clear':
+            self.errors = []
+        elif name == 'errorqueue.next':
+            if len(self.errors) == 0:
+                return '0\tQueue Is Empty\t0\t0'
+            code, message = self.errors.pop(0)
+            return f"{code}\t{message}\t2\t0"
+        elif name == 'display.clear':
+            self.display = ['', '']
+        elif name == 'display.setcursor':
+            self.cursor = int(args[0])
+        elif name == 'display.settext':
+            self.display[self.cursor - 1] = args[0]
+        elif name == 'beeper.beep':
+            if self.beeperEnable:
+                self.elapse('beep', args[0], sleep=False)
+        elif name.endswith('.run') and name[:-4] in self.scripts:
+            self.runScript(name[:-4], output)
+        elif name in self.scripts:
+            self.runScript(name, output)
+        else:
+            raise TspError(f"attempt to call a nil value ({name})")
+
+    def runScript(self, name, output):
+        for line in self.scripts[name]:
+            self.run(tokenize(line), output)
+
+    def format(self, value):
+        if value is None:
+            return 'nil'
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, float):
+            if value == int(value) and abs(value) < 1e15:
+                return str(int(value))
+            return f"{value:.9e}"
+        return str(value)
+
+    def channels(self, channelList):
+        result = []
+        for item in channelList.split(','):
+            item = item.strip()
+            if item == '':
+                continue
+            if item == 'allslots':
+                result += sorted(self.closed)
+            elif item in self.patterns:
+                result += self.patterns[item]
+            elif ':' in item:
+                first, last = item.split(':')
+                result += list(range(int(first), int(last) + 1))
+            elif re.fullmatch(r'[12]\d{3}', item):
+                result.append(int(item))
+            else:
+                raise TspError(f"Invalid channel list ({item})")
+        return result
+
+    def relays(self, channels, close):
+        for ch in channels:
+            if (ch in self.closed) != close:
+                self.stats['relayOps'] += 1
+                self.spend('relay')
+            if close:
+                self.closed.add(ch)
+            else:
+                self.closed.discard(ch)
+
+    def scan(self, buf):
+        previous = set()
+        for channelList, config in self.scanList:
+            step = set(self.channels(channelList))
+            if self.scanMode == 0:
+                self.relays(sorted(self.closed - step), close=False)
+            else:
+                self.relays(sorted(previous - step), close=False)
+            self.relays(sorted(step), close=True)
+            if config is not None:
+                if config in self.dmmConfigs and self.dmm != self.dmmConfigs[config]:
+                    self.dmm = dict(self.dmmConfigs[config])
+                    self.autodelayPending = True
+                buf.readings.append(self.measure())
+            previous = step
+        self.relays(sorted(previous), close=False)
+
+    # Circuit model
+
+    def dmmRange(self, value=None):
+        # With autorange, the smallest range for the value being measured
+        ranges = ohmRanges if self.dmm['func'] == 'twowireohms' else dcvRanges
+        limit = abs(value) if self.dmm['autorange'] and value is not None else abs(self.dmm['range'])
+        for r in ranges:
+            if limit <= r:
+                return r
+        return ranges[-1]
+
+    def dmmImpedance(self):
+        return 10e9 if self.dmmRange() <= 10 else 10e6
+
+    def network(self):
+        shorts = []
+        resistors = []
+        fixed = {GND: 0.0, V5: self.fixture['v5'], V250: self.fixture['v250']}
+        for ch in self.closed:
+            slot, number = divmod(ch, 1000)
+            common = ('common', slot)
+            if 1 <= number <= 88:
+                shorts.append((common, ('44' if slot == 2 else '37', number)))
+            elif slot == 2 and number == 89:
+                resistors.append((common, V5, self.fixture['R44']))
+            elif slot == 1 and number == 89:
+                resistors.append((common, GND, self.fixture['R37']))
+            elif slot == 2 and number == 90:
+                shorts.append((common, V250))
+            elif slot == 2 and number == 91:
+                resistors.append((common, V250, self.fixture['Rtest']))
+            elif slot == 1 and number == 90:
+                shorts.append((common, GND))
+            elif number == 911:
+                shorts.append((common, DMM))
+        for pin37, (pin44, r) in self.wires.items():
+            if r != math.inf:
+                resistors.append((('44', pin44), ('37', pin37), r))
+        for pin37, volts in self.pinVoltages.items():
+            source = ('pin', pin37)
+            fixed[source] = volts
+            resistors.append((source, ('37', pin37), self.fixture['pinR']))
+        for a, b, r in self.leaks:
+            resistors.append((a, b, r))
+        resistors.append((DMM, GND, self.dmmImpedance()))
+        return shorts, resistors, fixed
+
+    def voltage(self, node):
+        shorts, resistors, fixed = self.network()
+        return self.solve(shorts, resistors, fixed, node)[0]
+
+    def resistance(self):
+        # Two wire ohms reading: Thevenin resistance seen from the DMM, with the sources off, plus the open
+        # circuit voltage over the test current
+        shorts, resistors, fixed = self.network()
+        resistors = [resistor for resistor in resistors if DMM not in resistor[:2]]
+        voltage = self.solve(shorts, resistors, fixed, DMM)[0]
+        sources = {n: 0.0 for n in fixed}
+        sources[DMM] = 1.0
+        current = self.solve(shorts, resistors, sources, DMM)[1]
+        if current <= 0:
+            return math.inf
+        return 1.0 / current + voltage / ohmCurrent
+
+    def solve(self, shorts, resistors, fixed, node):
+        # Voltage of node and, when node has a fixed potential, the current it sources into the network. Only
+        # the part of the network reachable from node is solved
+        parent = {}
+
+        def find(n):
+            parent.setdefault(n, n)
+            while parent[n] != n:
+                parent[n] = parent[parent[n]]
+                n = parent[n]
+            return n
+
+        for a, b in shorts:
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                # Keep fixed potential nodes as roots
+                if ra in fixed:
+                    parent[rb] = ra
+                else:
+                    parent[ra] = rb
+        fixedRoots = {}
+        for n, v in fixed.items():
+            fixedRoots.setdefault(find(n), v)
+
+        target = find(node)
+        if target in fixedRoots and any(find(n) == target for n in fixed if n != node):
+            # Shorted to a fixed potential node
+            return fixedRoots[target], math.inf
+
+        neighbours = {}
+        for a, b, r in resistors:
+            ra, rb = find(a), find(b)
+            if ra == rb:
+                continue
+            g = 1.0 / r
+            neighbours.setdefault(ra, {})
+            neighbours.setdefault(rb, {})
+            neighbours[ra][rb] = neighbours[ra].get(rb, 0.0) + g
+            neighbours[rb][ra] = neighbours[rb].get(ra, 0.0) + g
+
+        # Only the component reachable from the measured node without crossing a fixed node matters
+        component = {target}
+        todo = [target]
+        while len(todo) > 0:
+            n = todo.pop()
+            if n in fixedRoots and n != target:
+                continue
+            for m in neighbours.get(n, {}):
+                if m not in component:
+                    component.add(m)
+                    todo.append(m)
+        unknowns = [n for n in component if n not in fixedRoots]
+        if not any(n in fixedRoots for n in component):
+            return 0.0, 0.0
+
+        # Nodal analysis: G * v = I
+        index = {n: i for i, n in enumerate(unknowns)}
+        size = len(unknowns)
+        G = [[0.0] * size for _ in range(size)]
+        I = [0.0] * size
+        for n in unknowns:
+            i = index[n]
+            for m, g in neighbours.get(n, {}).items():
+                G[i][i] += g
+                if m in fixedRoots:
+                    I[i] += g * fixedRoots[m]
+                elif m in index:
+                    G[i][index[m]] -= g
+        for col in range(size):
+            pivot = max(range(col, size), key=lambda r: abs(G[r][col]))
+            if G[pivot][col] == 0:
+                continue
+            G[col], G[pivot] = G[pivot], G[col]
+            I[col], I[pivot] = I[pivot], I[col]
+            for r in range(col + 1, size):
+                f = G[r][col] / G[col][col]
+                if f != 0:
+                    for c in range(col, size):
+                        G[r][c] -= f * G[col][c]
+                    I[r] -= f * I[col]
+        v = [0.0] * size
+        for r in range(size - 1, -1, -1):
+            s = I[r] - sum(G[r][c] * v[c] for c in range(r + 1, size))
+            v[r] = s / G[r][r] if G[r][r] != 0 else 0.0
+        if target in fixedRoots:
+            potential = fixedRoots[target]
+            current = sum(g * (potential - (fixedRoots[m] if m in fixedRoots else v[index[m]]))
+                          for m, g in neighbours.get(target, {}).items())
+            return potential, current
+        return v[index[target]], 0.0
+
+    def measure(self):
+        self.stats['readings'] += 1
+        nplc = float(self.dmm['nplc'])
+        count = int(self.dmm['filter.count']) if self.dmm['filter.enable'] else 1
+        if self.dmm['autodelay'] and self.autodelayPending:
+            self.spend('autodelay')
+            self.autodelayPending = False
+        self.elapse('reading', count * nplc / 60.0)
+
+        if self.dmm['func'] == 'twowireohms':
+            value = self.resistance() if any(ch % 1000 == 911 for ch in self.closed) else math.inf
+            if value == math.inf:
+                return 9.9e37
+        elif not any(ch % 1000 == 911 for ch in self.closed):
+            value = 0.0
+        else:
+            value = self.voltage(DMM)
+        dmmRange = self.dmmRange(value)
+        sigma = dmmRange * 2e-6 / math.sqrt(max(nplc, 0.0005) * count)
+        value += self.random.gauss(0.0, sigma)
+        if abs(value) > dmmRange * 1.2:
+            return 9.9e37
+        return value
+
+
+def serve(instrument, port):
+    # Answer newline terminated TSP messages on a TCP port like the 3700A on port 5025, every connection
+    # drives the same instrument
+    lock = threading.Lock()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                with lock:
+                    output = instrument.receive(line.decode().rstrip('\r\n'))
+                for response in output:
+                    self.wfile.write(response.encode() + b'\n')
+
+    socketserver.TCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer(('', port), Handler) as server:
+        print(f"Simulated 3700A listening on port {port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', dest='mapping', default='science_raft_channel_mapping.csv', help='Channels mapping csv file of the simulated feedthrough (DEFAULT: science_raft_channel_mapping.csv)')
+    parser.add_argument('--faults', dest='faults', default='', help='Comma separated faults: open:PIN37, res:PIN37:OHMS, leak:PIN44:PIN37:OHMS or leak:PIN44:gnd:OHMS')
+    parser.add_argument('--latency', dest='latency', help='Comma separated KIND=SECONDS, KIND in ' + ', '.join(latency))
+    parser.add_argument('--serve', dest='serve', type=int, nargs='?', const=5025, help='Listen for raw socket connections on port SERVE (DEFAULT: 5025) instead of reading the console')
+    parser.add_argument('--realtime', dest='realtime', help='Sleep for the simulated latencies', action="store_true")
+    return parser.parse_args(args[1:])
+
+
+if __name__ == "__main__":
+    # Interactive TSP console, one message per line, query outputs and errors are printed. Or raw socket server
+    args = parse_args(sys.argv)
+    latencies = parseLatencies(args.latency) if args.latency is not None else None
+    faults = [fault for fault in args.faults.split(',') if fault != '']
+    instrument = SimulatedInstrument(args.mapping, faults, latencies, args.realtime)
+    if args.serve is not None:
+        serve(instrument, args.serve)
+        print(instrument.summary())
+        sys.exit(0)
+    for line in sys.stdin:
+        output = instrument.ask(line.rstrip('\n'))
+        if output != '':
+            print(output)
+        for code, message in instrument.errors:
+            print(f"Error {code}: {message}")
+        instrument.errors = []
+    print(instrument.summary())
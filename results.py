@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Queries the results store written by vacFeedTester.py: the tests of a cable, the history of a channel, or the
+# text report of a test generated from its stored measurements.
+import argparse
+import json
+import sys
+from datetime import datetime
+
+from engineering_notation import EngNumber
+
+import vacFeedTester
+
+
+tests = {'continuity': 'Cont. Load', 'hipot': 'HiPot', 'pinout': 'Pinout'}
+
+
+def cableTests(db, cable, test=None):
+    query = ('SELECT id, test, time, passed, error, mapping, '
+             '(SELECT COUNT(*) FROM wires WHERE wires.test = tests.id AND NOT wires.passed) '
+             'FROM tests WHERE name = ?')
+    params = [cable]
+    if test is not None:
+        query += ' AND test = ?'
+        params.append(tests[test])
+    return db.execute(query + ' ORDER BY time', params).fetchall()
+
+
+def channelHistory(db, module, channel, cable=None, test=None, failed=False):
+    # Wires measured on a 44 pins or 37 pins channel, a Hi-Pot wire holds both 37 pins channels of its row
+    query = ('SELECT tests.id, tests.time, tests.name, tests.test, wires.row, wires.pin44, wires.pin37, wires.pin37B, '
+             'wires.r, wires.leakage, wires.voltage, wires.expected, wires.passed '
+             'FROM wires JOIN tests ON wires.test = tests.id WHERE ')
+    if module == 44:
+        query += 'wires.pin44 = ?'
+        params = [channel]
+    else:
+        query += '(wires.pin37 = ? OR wires.pin37B = ?)'
+        params = [channel, channel]
+    if cable is not None:
+        query += ' AND tests.name = ?'
+        params.append(cable)
+    if test is not None:
+        query += ' AND tests.test = ?'
+        params.append(tests[test])
+    if failed:
+        query += ' AND NOT wires.passed'
+    return db.execute(query + ' ORDER BY tests.time', params).fetchall()
+
+
+def printCableTests(rows):
+    print(f"{'id':>6}  {'time':<20}{'test':<12}{'result':<8}{'bad':>5}  mapping")
+    for testId, test, time, passed, error, mapping, bad in rows:
+        result = 'PASSED' if passed else 'FAILED'
+        print(f"{testId:>6}  {datetime.fromisoformat(time).strftime('%Y/%m/%d %H:%M:%S'):<20}{test:<12}{result:<8}{bad:>5}  "
+              f"{mapping}" + (f"  ({error})" if error is not None else ''))
+
+
+def printChannelHistory(rows):
+    print(f"{'id':>6}  {'time':<20}{'cable':<16}{'test':<12}{'wire':<16}{'value':>12}  result")
+    for testId, time, cable, test, row, pin44, pin37, pin37B, r, leakage, voltage, expected, passed in rows:
+        if test == 'HiPot':
+            wire = f"{pin37:02d}H,{pin37B:02d}H-/-{pin44:02d}H"
+            value = f"{EngNumber(r)}ohm" if leakage is not None else 'HI ohm'
+        elif test == 'Pinout':
+            wire = f"{pin37:02d}H"
+            value = f"{voltage:.2f}v"
+        else:
+            wire = f"{pin37:02d}H--{pin44:02d}H"
+            value = f"{EngNumber(r)}ohm"
+        print(f"{testId:>6}  {datetime.fromisoformat(time).strftime('%Y/%m/%d %H:%M:%S'):<20}{cable:<16}{test:<12}"
+              f"{wire:<16}{value:>12}  {'OK' if passed else 'Error'}")
+
+
+def report(db, testId):
+    # Text report of a test, as written by vacFeedTester.py
+    test = db.execute('SELECT test, name, time, passed, error, setup FROM tests WHERE id = ?', [testId]).fetchone()
+    if test is None:
+        raise ValueError(f"No test {testId} in the results store")
+    test, cable, time, passed, error, setup = test
+    setup = json.loads(setup) if setup is not None else None
+    wires = db.execute('SELECT row, pin44, pin37, pin37B, voltages, r, leakage, expected, voltage, passed '
+                       'FROM wires WHERE test = ? ORDER BY rowid', [testId]).fetchall()
+    return vacFeedTester.formatReport(test, cable, datetime.fromisoformat(time), passed, error, setup, wires)
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', dest='db', default='reports/results.db', help='Results store written by vacFeedTester.py (DEFAULT: reports/results.db)')
+    parser.add_argument('--cable', dest='cable', help='List the tests of the cable with this name, or only its measurements with --pin37 and --pin44')
+    parser.add_argument('--pin37', dest='pin37', type=int, help='List the measurements of this 37 pins module channel')
+    parser.add_argument('--pin44', dest='pin44', type=int, help='List the measurements of this 44 pins module channel')
+    parser.add_argument('--test', dest='test', choices=list(tests), help='Only list the results of this test')
+    parser.add_argument('--failed', dest='failed', help='Only list the failed channel measurements', action="store_true")
+    parser.add_argument('--report', dest='report', type=int, help='Print the text report of the test with this id')
+    return parser.parse_args(args[1:])
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv)
+    db = vacFeedTester.openStore(args.db)
+    if args.report is not None:
+        print(report(db, args.report), end='')
+    elif args.pin37 is not None or args.pin44 is not None:
+        module, channel = (37, args.pin37) if args.pin37 is not None else (44, args.pin44)
+        printChannelHistory(channelHistory(db, module, channel, args.cable, args.test, args.failed))
+    elif args.cable is not None:
+        printCableTests(cableTests(db, args.cable, args.test))
+    else:
+        print("One of --cable, --pin37, --pin44 or --report is needed")
+        sys.exit(1)
@@ -6,11 +6,100 @@ import argparse
 import sys
 import os
 import time
+import socket
+import queue
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import threading
+import json
+import hashlib
+import contextlib
+import io
+import tempfile
+import re
+import statistics
+import sqlite3
 from engineering_notation import EngNumber
+import keithleySim
 
 
 maxWireR = 2 # Continuity test max acceptable wire impedance in ohms
+baselineTolerance = 0.05 # Continuity test tolerance of the baseline readings in volts
 minIsolationR = 1e6 # Hi-Pot Test min acceptable isolation impedance in ohms
+nominalR37 = 5.3 # Continuity load resistors of the test boards in ohms, measured with --bridge, see bridgeCalibration()
+nominalR44 = 10.3
+fixtureTolerance = 0.2 # Largest relative difference of the measured load resistors from the nominal ones
+
+instr = None
+transport = 'vxi11' # Link to the instrument: 'vxi11', 'socket', 'sim' or 'replay', see connect()
+simulator = None # keithleySim.SimulatedInstrument used instead of the 3700A, see connect()
+displayWorker = None # Background front panel updater, see startDisplay()
+reportSink = None # Background writer of the reports, journal and results store, see post()
+backgroundReports = True # Write them from the test thread instead when False
+liveFeed = None # Measurement events published to the live dashboard, see startLive()
+liveBacklog = 1000 # Events queued for a dashboard client before it loses them and gets the current state instead
+
+errorCheck = 'reading' # When the error queue is checked: after each 'reading', 'row' or 'phase', or 'status' byte only
+errorLevels = ['reading', 'row', 'phase']
+testPhase = None # Test phase and channelTable row being measured, used to tag the readings
+testRow = None
+uncheckedReadings = [] # Readings taken since the error queue was last checked
+
+listeners = [] # Functions called with the result records of the tests, see emit()
+# Fields of the good and bad wires lists of each test
+wireFields = {'Cont. Load': ['pin37', 'pin44', 'r'],
+              'HiPot': ['pin37A', 'pin37B', 'pin44', 'r'],
+              'Pinout': ['pin37', 'expected', 'voltage']}
+# Titles of the text reports of each test and headings of their rows, see formatReport()
+reportTitles = {'Cont. Load': 'Continuity and Load', 'HiPot': 'Hi-Pot', 'Pinout': 'Pinout'}
+reportHeadings = {'Cont. Load': 'Cont. Load', 'HiPot': 'HiPot', 'Pinout': 'Pinout Test'}
+
+resultsDb = None # SQLite results store the tests are saved to, see openStore()
+store = None
+storeTest = {} # Test being measured: its 'time', 'setup' and the 'wires' saved to the store when it ends
+
+journal = None # File the measurements of the run are appended to as they are taken, see openJournal()
+journaled = {} # Records of the journal being resumed, by test: 'time', 'setup', 'rows' and 'passed', see loadJournal()
+# Command line options a resumed run takes from its journal
+journalArgs = ['hiPot', 'contLoad', 'tests', 'pinout', 'fused', 'tsp', 'scan', 'plan', 'groups', 'screen', 'bridge',
+               'name', 'mapping']
+
+mappingFile = None # Mapping loaded by readCsv() and the SHA-256 of its contents
+mappingHash = None
+compiledPlan = None # Operations of each test for the channelTable rows, see compilePlan()
+planCache = 'plans' # Directory of the compiled plans, named after the hash of their mapping file
+planVersion = '2' # Changes with the compiled plan contents, to ignore the plans compiled before
+maxPinChannel = 88 # 3722 channels wired to the feedthrough pins, the ones above go to the supplies and ground
+
+relayTracking = False # Only send relay operations that change the state in closedRelays
+relayVerify = 'phase' # When closedRelays is checked against the instrument: 'never', after each 'row' or 'phase'
+closedRelays = set() # Channels closed on the instrument, as module * 1000 + channel
+
+# DMM settings of each kind of measurement: integration time in power line cycles, range in volts (None keeps the
+# range set by the test), repeat filter count (1 disables the filter) and autodelay. See applyProfile()
+profiles = {
+    'supply': {'nplc': 1, 'range': None, 'filter': 3, 'autodelay': True},
+    'baseline': {'nplc': 1, 'range': 7, 'filter': 3, 'autodelay': True},
+    'bridge': {'nplc': 1, 'range': 7, 'filter': 3, 'autodelay': True},
+    'leakage': {'nplc': 1, 'range': 260, 'filter': 3, 'autodelay': True},
+    'pinout': {'nplc': 1, 'range': None, 'filter': 3, 'autodelay': True},
+    'screen': {'nplc': 0.1, 'range': None, 'filter': 1, 'autodelay': True},
+}
+profileOverride = None # Profile used instead of every other one, e.g. 'screen' during the screening pass
+dmmSettings = {} # DMM settings written since the last reset()
+
+# Largest reading error each profile can have, from the tolerances its readings are checked against. The bridge
+# readings give the wire resistance: 10mV is ~0.05ohm with the ~0.3A of the continuity test
+profileTolerance = {'supply': 0.05, 'baseline': 0.05, 'bridge': 0.01, 'leakage': 0.05, 'pinout': 0.1}
+calibrationMargin = 0.25 # Fraction of the tolerance the noise (3 sigma) plus offset of a calibrated profile may use
+calibrationNplc = [0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2]
+calibrationFilter = [1, 3, 10]
+lineFrequency = 60
+
+settleTolerance = 0.05 # Supply readings are stable when two consecutive ones are within settleTolerance volts
+settleTimeout = 5
+relayActuationTime = 0.005 # 3722 relay operate and settling time in seconds, used for the planner estimates
+autodelayTime = 0.002 # DMM autodelay before the first reading after a settings change, used for the planner estimates
 
 
 def preConfiguration():
@@ -19,19 +108,21 @@ def preConfiguration():
 
     # Reset the 3700A to factory defaults
     instr.write('reset()')
+    closedRelays.clear()
+    dmmSettings.clear()
     instr.write('channel.connectrule = channel.BREAK_BEFORE_MAKE')
 
     # Configure 37 pins module as a 96 channels device. Connect two halves of module 1 using backplane bank 3
-    instr.write('channel.close("1913,1923")')
+    chClose(1, [913, 923])
     # Configure 44 pins module as a 96 channels device. Connect two halves of module 2 using backplane bank 4
-    instr.write('channel.close("2914,2924")')
+    chClose(2, [914, 924])
 
     # Configure DMM
     instr.write('dmm.connect = dmm.CONNECT_TWO_WIRE')
-    instr.write('dmm.autodelay = dmm.AUTODELAY_ONCE')
-    instr.write('dmm.filter.count = 3')
+    setDmm('autodelay', 'dmm.AUTODELAY_ONCE')
+    setDmm('filter.count', 3)
     instr.write('dmm.filter.type = dmm.FILTER_REPEAT_AVG')
-    instr.write('dmm.filter.enable = dmm.ON')
+    setDmm('filter.enable', 'dmm.ON')
 
     instr.write('errorqueue.clear()')
 
@@ -41,31 +132,46 @@ def preConfiguration():
     instr.write('beeper.enable = 1')
 
 
-def continuityLoadTest():
-    
+def changePhase(keep):
+    # Between the tests of a session, instead of preConfiguration(): open the channels closed by the previous
+    # test except the backplane and the keep ones, closed first by the next test. The DMM settings that
+    # differ are switched by the next test
+    backplane = [1913, 1923, 2914, 2924]
+    closed = closedRelays if relayTracking else getClosed()
+    for module in (1, 2):
+        channels = [ch % 1000 for ch in sorted(closed)
+                    if ch // 1000 == module and ch not in backplane and ch not in keep]
+        if len(channels) > 0:
+            chOpen(module, channels)
 
-    v0 = 0
-    vHalf = 1.66
 
-    i = datetime.now()
-    with open("reports/continuity_load_" + i.strftime('%Y_%m_%d_%Hh%Mm%Ss') + f"_{name}.txt", 'w') as file:
+def continuityLoadTest(tsp=False, plan=False, screen=None, session=None, bridge=False):
+    passed = resumedResult("Cont. Load")
+    if passed is not None:
+        return passed
+
+    i = testTime("Cont. Load", session)
+    with testReport("Cont. Load", "reports/continuity_load_" + i.strftime('%Y_%m_%d_%Hh%Mm%Ss') + f"_{name}.txt") as file:
 
-        fileWrite(file, "LSST Camera Vacuum feedthrough Continuity and Load Test\n")
-        fileWrite(file, name + "\n")
-        fileWrite(file, i.strftime('%Y/%m/%d %H:%M:%S\n\n'))
+        reportWrite(reportHeader("Cont. Load", name, i))
 
         show("Cont. Load Test", "Preparing for test")
+        setContext("Cont. Load")
 
-        preConfiguration()
+        if session is None:
+            preConfiguration()
+        else:
+            changePhase([2089, 2093])
 
-        instr.write('dmm.func = "dcvolts"')
-        instr.write('dmm.range = 7')
+        setDmm('func', '"dcvolts"')
+        setDmm('range', 7)
 
         # Setup common voltages
         # 5V to HI on 44 pin module
         chClose(2, 89)
         # GND to LO on 44 pin module
         chClose(2, 93)
+        applyProfile('supply')
         v5 = read(2)
 
 
@@ -75,10 +181,9 @@ def continuityLoadTest():
             errorBeep()
             errorBeep()
             errorBeep()
-            fileWrite(file, "\n---> Cont. Load Test FAILED!\n\n")
-            fileWrite(file, f"Power supply not powered on (<4.5v)\n")
-
-            fileWrite(file, "\n\n")
+            error = "Power supply not powered on (<4.5v)"
+            reportWrite(reportError("Cont. Load", error))
+            testResult("Cont. Load", False, [], [], [file], error)
             return False
 
         # GND to HI on 37 pin module
@@ -89,186 +194,302 @@ def continuityLoadTest():
         goodWires = []
         badWires = []
 
-        R37 = 5.3
-        R44 = 10.3
+        setup = resumed("Cont. Load", 'setup')
+        if setup is None:
+            R37 = nominalR37
+            R44 = nominalR44
+            if bridge:
+                show("Cont. Load Test", "Measuring load resistors")
+                R37, R44 = bridgeCalibration(v5)
+                if abs(R37 - nominalR37) > fixtureTolerance * nominalR37 or abs(R44 - nominalR44) > fixtureTolerance * nominalR44:
+                    show("Cont. Load. FAILED!", "$BLoad resistors out of tolerance")
+                    errorBeep()
+                    errorBeep()
+                    errorBeep()
+                    errorBeep()
+                    error = f"Load resistors out of tolerance: R37 {EngNumber(R37)}ohm, R44 {EngNumber(R44)}ohm"
+                    reportWrite(reportError("Cont. Load", error))
+                    testResult("Cont. Load", False, [], [], [file], error)
+                    return False
+            setup = journalSetup("Cont. Load", {'v5': v5, 'R37': R37, 'R44': R44, 'maxWireR': maxWireR,
+                                                'baselineTolerance': baselineTolerance})
+        else:
+            # Resumed setup, the load resistors aren't measured again
+            storeTest['setup'] = setup
+        v5, R37, R44 = setup['v5'], setup['R37'], setup['R44']
 
 
         s1 = f"Cont. Load Test (0/{2*len(channelTable)})"
-        s2 = f"R37: {EngNumber(R37)}ohm"
-        fileWrite(file, s2 + "\n")
-        show(s1, s2)
-
-        s2 = f"R44: {EngNumber(R37)}ohm"
-        fileWrite(file, s2 + "\n")
-        show(s1, s2)
-
-        s2 = f"R cable threshold: {EngNumber(maxWireR)}ohm"
-        fileWrite(file, s2 + "\n")
-        show(s1, s2)
-
-
-        s2 = f"Power Supply Voltage: {EngNumber(v5)}v"
-        fileWrite(file, s2 + "\n")
-        show(s1, s2)
+        reportWrite(reportSetup("Cont. Load", setup), s1=s1)
+
+        rowOpsName = 'bridge' if bridge else 'continuity'
+        resumedRows = resumed("Cont. Load", 'rows') or {}
+        if len(resumedRows) > 0 and (tsp or plan or screen is not None):
+            consoleWrite(f"Resuming with {len(resumedRows)} of {len(channelTable)} rows measured, the other rows are measured one at a time")
+            tsp = plan = False
+            screen = None
+
+        rowVoltages = None
+        if screen is not None:
+            dmmScreening(True)
+        if tsp:
+            show(s1, "Running on instrument")
+            rowVoltages = runContinuityTsp(rowOpsName)
+        elif plan:
+            rowVoltages = measurePlan("Cont. Load", planTest("Cont. Load", compiledPlan[rowOpsName], closedRelays), 8)
+        elif screen is not None:
+            rowVoltages = measurePlan("Cont. Load", [(i, rowOps(rowOpsName, i)) for i in range(len(channelTable))], 8)
+        if bridge and rowVoltages is not None:
+            for voltages in rowVoltages:
+                bridgeBaseline(voltages)
+
+        if screen is not None:
+            # Re-measure at full precision the rows the screening readings can't decide
+            dmmScreening(False)
+            remeasure = [i for i, voltages in enumerate(rowVoltages) if nearLimit(voltages, v5, R37, R44, screen, bridge)]
+            for i in remeasure:
+                setContext("Cont. Load", i + 1)
+                show(f"Cont. Load ({i + 1}/{len(channelTable)})", "Re-measuring")
+                rowVoltages[i] = measureContinuityRow(i, bridge)
+            consoleWrite(f"Screening: {len(remeasure)} of {len(channelTable)} rows re-measured at full precision")
 
         n = 1
+        drift = 0
         for row in channelTable:
             s1 = f"Cont. Load ({n}/{len(channelTable)})"
-            fileWrite(file, "\n" + s1 + "\n")
-            pin44 = row[0]
-            pin37A = row[1]
-            pin37B = row[2]
-
-            # Test wire A
-            wireValid = True
-            chClose(2, pin44)
-            valid1, voltage1, expected1 = read(1, v0)
-            valid2, voltage2, expected2 = read(2, v5)
-            c1 = (voltage1) / R37
-            c2 = (v5 - voltage2) / R44
-            c = (c1 + c2) / 2.0
-            r = abs(voltage2 - voltage1) / c
-
-            valid = 'Error'
-            if (valid1 and valid2): valid = 'OK'
-            s2 = f"    -- {pin44:02d}H {valid}            {voltage1:.2f}|{voltage2:.2f} v  ({expected1:.2f}|{expected2:.2f})v"
-            show(s1, s2)
-            fileWrite(file, s2 + "\n")
-            wireValid &= valid1 and valid2
-
-            chClose(1, pin37A)
-            valid1, voltage1, expected1 = read(1, vHalf,0.40)
-            valid2, voltage2, expected2 = read(2, vHalf,0.40)
-
-            c = (v5-voltage2)/R44
-            r = abs(voltage2-voltage1)/c
-
-            valid = 'Error'
-            if (r<maxWireR and r>0): valid = 'OK'
-            s2 = f"{pin37A:02d}H -- {pin44:02d}H {valid}  {EngNumber(r)}ohm   {voltage1:.2f}|{voltage2:.2f} v  ({expected1:.2f}|{expected2:.2f})v"
-            show(s1, s2)
-            fileWrite(file, s2 + "\n")
-            chOpen(1, pin37A)
-
-            wireValid &= r<maxWireR
-            if wireValid:
-                goodWires.append([pin37A, pin44,r])
-            else:
-                badWires.append([pin37A, pin44,r])
-                errorBeep()
+            reportWrite("\n" + s1 + "\n")
+            setContext("Cont. Load", n)
 
-            # Test wire B
-            wireValid = True
-            valid1, voltage1, expected1 = read(1, v0)
-            valid2, voltage2, expected2 = read(2, v5)
-            c1 = (voltage1) / R37
-            c2 = (v5 - voltage2) / R44
-            c = (c1 + c2) / 2.0
-            r = abs(voltage2 - voltage1) / c
-
-            valid = 'Error'
-            if (valid1 and valid2): valid = 'OK'
-            s2 = f"    -- {pin44:02d}H {valid}            {voltage1:.2f}|{voltage2:.2f} v  ({expected1:.2f}|{expected2:.2f})v"
-            show(s1, s2)
-            fileWrite(file, s2 + "\n")
-            wireValid &= valid1 and valid2
-
-            chClose(1, pin37B)
-            valid1, voltage1, expected1 = read(1, vHalf,0.4)
-            valid2, voltage2, expected2 = read(2, vHalf,0.4)
-
-            c1 = (voltage1) / R37
-            c2 = (v5 - voltage2) / R44
-            c = (c1 + c2) / 2.0
-            r = abs(voltage2 - voltage1) / c
-
-            valid = 'Error'
-            if (r < maxWireR and r>0): valid = 'OK'
-            s2 = f"{pin37B:02d}H -- {pin44:02d}H {valid}  {EngNumber(r)}ohm   {voltage1:.2f}|{voltage2:.2f} v  ({expected1:.2f}|{expected2:.2f})v"
-            show(s1, s2)
-            fileWrite(file, s2 + "\n")
-            chOpen(1, pin37B)
-
-            wireValid &= r<maxWireR
-            if wireValid:
-                goodWires.append([pin37B, pin44,r])
-            else:
-                badWires.append([pin37B, pin44,r])
-                errorBeep()
+            record = resumedRows.get(n - 1)
+            if record is None:
+                if rowVoltages is not None:
+                    voltages = rowVoltages[n - 1]
+                else:
+                    voltages = measureContinuityRow(n - 1, bridge)
+                record = journalRow("Cont. Load", n - 1, voltages)
+            voltages = record['voltages']
+            continuityRow(s1, row, voltages, setup, goodWires, badWires, bridge)
+            if bridge and check(voltages[1], v5)[0]:
+                drift = max(drift, abs(voltages[1] - v5))
+            checkpoint('row')
 
-            chOpen(2, pin44)
             n += 1
 
-        fileWrite(file, "\n-----------------------------------------------------------------------------------\n")
-        if len(badWires) > 0:
+        checkpoint('phase')
+        if bridge:
+            storeTest['setup'] = dict(setup, drift=drift)
+        result = len(badWires) == 0
+        if not result:
             show("$BCont. Load FAILED!", f"$B{len(badWires)} of {len(channelTable)*2} wires are bad")
             errorBeep()
             errorBeep()
-            fileWrite(file, "\n---> Continuity and Load Test FAILED!\n\n")
-            fileWrite(file, f"{len(goodWires)} of {len(channelTable)*2} wires passed the Continuity and Load Test\n\n")
-
-            fileWrite(file, f"These wires passed:\n\n")
-            fileWrite(file, f"pin37\t\tpin47\t\t\n")
-            fileWrite(file, f"-----\t\t-----\t\t-----\n")
-            for pair in goodWires:
-                fileWrite(file, f"CH{pair[0]}H\t\tCH{pair[1]}H\t\t{EngNumber(pair[2])}ohm\n")
-
-            fileWrite(file, f"\nThese wires failed:\n\n")
-            fileWrite(file, f"pin37\t\tpin47\t\t\n")
-            fileWrite(file, f"-----\t\t-----\t\t-----\n")
-            for pair in badWires:
-                fileWrite(file, f"CH{pair[0]}H\t\tCH{pair[1]}H\t\t{EngNumber(pair[2])}ohm\n")
-            result = False
         else:
             show("Cont. Load PASSED!", f"{len(goodWires)} of {len(channelTable)*2} wires are good")
             successBeep()
-            fileWrite(file, "\n---> Continuity and Load Test PASSED!\n\n")
-            fileWrite(file, f"{len(goodWires)} of {len(channelTable)*2} wires passed the Continuity and Load Test\n\n")
-            fileWrite(file, f"pin37\t\tpin47\t\t\n")
-            fileWrite(file, f"-----\t\t-----\t\t-----\n")
-            for pair in goodWires:
-                fileWrite(file, f"CH{pair[0]}H\t\tCH{pair[1]}H\t\t{EngNumber(pair[2])}ohm\n")
-            result = True
-
-        fileWrite(file, "\n\n")
+
+        reportWrite(reportSummary("Cont. Load", result, storeTest['setup'], storeTest['wires']))
+        testResult("Cont. Load", result, goodWires, badWires, [file])
         return result
 
 
-def hiPotTest():
-  
-    v0=0
+def continuityOps(row, legs=(1, 2)):
+    # For each wire: baseline readings, then readings with the 37 pins channel closed. Readings 0-3 are wire A,
+    # 4-7 wire B, whatever the order of the legs
+    pin44 = row[0]
+
+    ops = [('close', 2, [pin44])]
+    for leg in legs:
+        index = 4 * (leg - 1)
+        ops += [('profile', 'baseline'), ('read', 1, index), ('read', 2, index + 1),
+                ('close', 1, [row[leg]]),
+                ('profile', 'bridge'), ('read', 1, index + 2), ('read', 2, index + 3),
+                ('open', 1, [row[leg]])]
+    ops.append(('open', 2, [pin44]))
+
+    return ops
+
 
-    i = datetime.now()
-    with open("reports/hi_pot_details" + i.strftime('%Y_%m_%d_%Hh%Mm%Ss') + f"_{name}.txt", 'w') as file2:
-        with open("reports/hi_pot_" + i.strftime('%Y_%m_%d_%Hh%Mm%Ss') + f"_{name}.txt", 'w') as file:
-            fileWrite(file, "LSST Camera Vacuum feedthrough Hi-Pot Test\n",file2)
-            fileWrite(file, name + "\n",file2)
-            fileWrite(file, i.strftime('%Y/%m/%d %H:%M:%S\n\n'),file2)
+def bridgeOps(row, legs=(1, 2)):
+    # Bridge model: the baseline readings 0-1 are taken once for both wires, then the readings with each 37 pins
+    # channel closed. Readings 2-3 are wire A, 6-7 wire B, see bridgeBaseline()
+    pin44 = row[0]
+
+    ops = [('close', 2, [pin44]), ('profile', 'baseline'), ('read', 1, 0), ('read', 2, 1)]
+    for leg in legs:
+        index = 4 * (leg - 1)
+        ops += [('close', 1, [row[leg]]),
+                ('profile', 'bridge'), ('read', 1, index + 2), ('read', 2, index + 3),
+                ('open', 1, [row[leg]])]
+    ops.append(('open', 2, [pin44]))
+
+    return ops
+
+
+def bridgeBaseline(voltages):
+    # Wire B baseline readings 4-5 are those of the 44 pins channel, taken once by bridgeOps()
+    voltages[4:6] = voltages[0:2]
+    return voltages
+
+
+def bridgeCalibration(v5):
+    # Measure the load resistors of the bridge model, with 5V on the 44 pins module and GND on the 37 pins
+    # module: R37 with the ohmmeter, it only goes to GND, then R44 from the R44/R37 divider made by connecting
+    # both modules to the DMM at once
+    setDmm('func', '"twowireohms"')
+    applyProfile('bridge')
+    R37 = read(1)
+    setDmm('func', '"dcvolts"')
+    applyProfile('bridge')
+
+    chClose(1, 911)
+    chClose(2, 911)
+    vDivider = float(instr.ask('print(dmm.measure())'))
+    uncheckedReadings.append(f"{readingTag()} slots 1 and 2: {vDivider}")
+    errorCheckpoint('reading')
+    chOpen(2, 911)
+    if not relayTracking:
+        chOpen(1, 911)
+
+    # No divider voltage: R37 or R44 is open, out of tolerance
+    R44 = R37 * (v5 - vDivider) / vDivider if vDivider > 0 else 0.0
+    return R37, R44
+
+
+def measureContinuityRow(i, bridge=False):
+    if bridge:
+        return bridgeBaseline(runOps(rowOps('bridge', i), 8))
+    return runOps(rowOps('continuity', i), 8)
+
+
+def continuityRow(s1, row, voltages, setup, goodWires, badWires, bridge=False):
+    v0 = 0
+    v5 = setup['v5']
+    tolerance = setup['baselineTolerance']
+
+    pin44 = row[0]
+    resistances = wireResistances(voltages, v5, setup['R37'], setup['R44'], bridge)
+
+    # Wire A readings are 0-3, wire B 4-7: the 44 pins channel baseline, then with the 37 pins channel closed
+    for leg in (1, 2):
+        pin37 = row[leg]
+        index = 4 * (leg - 1)
+        r = resistances[leg - 1]
+
+        wireValid = check(voltages[index], v0, tolerance)[0] and check(voltages[index + 1], v5, tolerance)[0]
+        wireValid &= r<setup['maxWireR'] and r>0
+        wire = storeWire(row, pin37, voltages[index:index + 4], wireValid, r=r)
+        reportWrite(reportWire("Cont. Load", setup, wire), s1=s1)
+        if wireValid:
+            goodWires.append([pin37, pin44,r])
+        else:
+            badWires.append([pin37, pin44,r])
+            errorBeep()
+
+
+def wireResistances(voltages, v5, R37, R44, bridge=False):
+    if bridge:
+        # Current of both wires from the average of both measured load resistors. The supply is the 44 pins
+        # baseline reading of the row, taken with no current flowing, to follow its drift
+        supply = voltages[1] if check(voltages[1], v5)[0] else v5
+        resistances = []
+        for index in (2, 6):
+            voltage1, voltage2 = voltages[index], voltages[index + 1]
+            c = (voltage1 / R37 + (supply - voltage2) / R44) / 2.0
+            resistances.append(abs(voltage2 - voltage1) / c)
+        return resistances
+
+    # Wire A current from the 44 pins side only, wire B from the average of both sides
+    voltage1, voltage2 = voltages[2], voltages[3]
+    c = (v5-voltage2)/R44
+    rA = abs(voltage2-voltage1)/c
+
+    voltage1, voltage2 = voltages[6], voltages[7]
+    c1 = (voltage1) / R37
+    c2 = (v5 - voltage2) / R44
+    c = (c1 + c2) / 2.0
+    rB = abs(voltage2 - voltage1) / c
+
+    return [rA, rB]
+
+
+def nearLimit(voltages, v5, R37, R44, margin, bridge=False):
+    # True when a verdict taken from these readings could change with full precision readings: a wire within
+    # margin of maxWireR or a baseline reading within margin of its tolerance
+    for r in wireResistances(voltages, v5, R37, R44, bridge):
+        if abs(r - maxWireR) < margin * maxWireR:
+            return True
+    for index, expected in ((0, 0), (1, v5), (4, 0), (5, v5)):
+        if abs(abs(voltages[index] - expected) - baselineTolerance) < margin * baselineTolerance:
+            return True
+    return False
+
+
+def dmmScreening(enable):
+    # The 'screen' profile for every reading of the screening pass, the profile of each reading otherwise
+    global profileOverride
+    profileOverride = 'screen' if enable else None
+
+
+def runContinuityTsp(rowOpsName='continuity'):
+    # Upload the whole continuity/load sequence as a TSP script so the relays and the DMM are driven by the
+    # 3700A itself. Each row produces the same readings as measureContinuityRow(), in the order of its operations
+    indexes = [[op[2] for op in rowOps(rowOpsName, n) if op[0] == 'read'] for n in range(len(channelTable))]
+    count = sum(len(rowIndexes) for rowIndexes in indexes)
+    lines = [f'vfBuf = dmm.makebuffer({count})']
+    settings = dict(dmmSettings)
+    for n in range(1, len(channelTable) + 1):
+        line = f'display.clear() display.setcursor(1, 1) display.settext("Cont. Load ({n}/{len(channelTable)})") '
+        line += tspOps(rowOps(rowOpsName, n - 1), settings)
+        lines.append(line)
+
+    loadScript('vacFeedContinuity', lines)
+    readings = iter(runScript('vacFeedContinuity', 'vfBuf', count))
+    dmmSettings.update(settings)
+
+    rowVoltages = []
+    for rowIndexes in indexes:
+        voltages = [None] * 8
+        for index in rowIndexes:
+            voltages[index] = next(readings)
+        rowVoltages.append(voltages)
+    return rowVoltages
+
+
+def hiPotTest(scan=False, plan=False, groups=False, session=None):
+    passed = resumedResult("HiPot")
+    if passed is not None:
+        return passed
+
+    i = testTime("HiPot", session)
+    with reportFile("reports/hi_pot_details" + i.strftime('%Y_%m_%d_%Hh%Mm%Ss') + f"_{name}.txt") as file2:
+        with testReport("HiPot", "reports/hi_pot_" + i.strftime('%Y_%m_%d_%Hh%Mm%Ss') + f"_{name}.txt") as file:
+            reportWrite(reportHeader("HiPot", name, i), file2)
 
             show("HiPot. Test", "Preparing for test")
-            preConfiguration()
+            setContext("HiPot")
+            if session is None:
+                preConfiguration()
+            else:
+                changePhase([2090, 2093])
 
-            instr.write('dmm.func = "dcvolts"')
-            instr.write('dmm.range = 260')
+            setDmm('func', '"dcvolts"')
+            setDmm('range', 260)
 
             Rtest = 100000
 
 
+            # Setup of the report when the supply check fails, journalSetup() replaces it
+            storeTest['setup'] = {'Rtest': Rtest, 'minIsolationR': minIsolationR}
             s1 = f"HiPot (0/{len(channelTable)})"
-            s2 = f"Rtest: {EngNumber(Rtest)}ohm"
-            fileWrite(file, s2 + "\n",file2)
-            show(s1, s2)
-
-            s2 = f"R Threshold : {EngNumber(minIsolationR)}ohm"
-            fileWrite(file, s2 + "\n",file2)
-            show(s1, s2)
+            thresholds = reportSetup("HiPot", storeTest['setup'])
+            reportWrite(thresholds, file2, s1)
 
             # 250V to HI directly on 44 pin module
             chClose(2, 90)
             # GND to LO on 44 pin module
             chClose(2, 93)
-            time.sleep(1)
-            v250 = read(2)
+            applyProfile('supply')
+            v250 = waitStable(2)
             # 250V to HI on 44 pin module
             chOpen(2, 90)
 
@@ -278,38 +499,26 @@ def hiPotTest():
                 errorBeep()
                 errorBeep()
                 errorBeep()
-                fileWrite(file, "\n---> Hi-Pot Test FAILED!\n\n",file2)
-                fileWrite(file, f"Power supply not powered on (<220v)\n",file2)
-
-                fileWrite(file, "\n\n",file2)
+                error = "Power supply not powered on (<220v)"
+                reportWrite(reportError("HiPot", error), file2)
+                testResult("HiPot", False, [], [], [file, file2], error)
                 return False
 
 
-            s2 =  f"Power supply voltage: {v250:.3f} v"
-            fileWrite(file, s2 + "\n",file2)
-            show(s1, s2)
-
             # 250V to HI trough RTest on 44 pin module
             chClose(2, 91)
             # GND to LO on 44 pin module
             chClose(2, 93)
 
+            applyProfile('leakage')
             Vdmm = read(2)
             Rdmm = -Vdmm * Rtest/( Vdmm - v250)
+            setup = journalSetup("HiPot", {'v250': v250, 'Rtest': Rtest, 'Vdmm': Vdmm, 'Rdmm': Rdmm,
+                                           'minIsolationR': minIsolationR})
+            v250, Vdmm, Rdmm = setup['v250'], setup['Vdmm'], setup['Rdmm']
 
-            s2 = f"Rtest: {EngNumber(Rtest)}ohm"
-            fileWrite(file, s2 + "\n",file2)
-            show(s1, s2)
-
-
-            s2 =  f"Voltage after Rtest: {EngNumber(Vdmm)}v"
-            fileWrite(file, s2 + "\n",file2)
-            show(s1, s2)
-
-
-            s2 =  f"DMM input impedance: {EngNumber(Rdmm)}ohm"
-            fileWrite(file, s2 + "\n",file2)
-            show(s1, s2)
+            # The threshold lines are already written
+            reportWrite(reportSetup("HiPot", setup)[len(thresholds):], file2, s1)
 
 
             # GND to HI on 37 pin module
@@ -322,118 +531,255 @@ def hiPotTest():
             goodWires = []
             badWires = []
 
+            resumedRows = resumed("HiPot", 'rows') or {}
+            if len(resumedRows) > 0 and (groups or scan or plan):
+                consoleWrite(f"Resuming with {len(resumedRows)} of {len(channelTable)} rows measured, the other rows are measured one at a time")
+                groups = scan = plan = False
+
+            rowVoltages = None
+            groupBounds = None
+            if groups:
+                rowVoltages, groupBounds = hiPotGroupTest(file2, v250, Rtest, Rdmm)
+            elif scan:
+                show(s1, "Running scan")
+                readings = runScan(hiPotScanSteps(), 'leakage')
+                rowVoltages = [readings[i:i + 2] for i in range(0, len(readings), 2)]
+            elif plan:
+                rowVoltages = measurePlan("HiPot", planTest("HiPot", compiledPlan['hipot'], closedRelays), 2)
+
             n = 1
             for row in channelTable:
                 s1 = f"HiPot ({n}/{len(channelTable)})"
-                fileWrite(file, "\n" + s1 + "\n",file2)
-
-                pin44 = row[0]
-                pin37A = row[1]
-                pin37B = row[2]
+                reportWrite("\n" + s1 + "\n", file2)
+                setContext("HiPot", n)
+
+                record = resumedRows.get(n - 1)
+                if record is None:
+                    if rowVoltages is not None and rowVoltages[n - 1] is not None:
+                        voltages = rowVoltages[n - 1]
+                    else:
+                        voltages = measureHiPotRow(n - 1)
+                    record = journalRow("HiPot", n - 1, voltages, groupBounds[n - 1] if groupBounds is not None else None)
+                voltages = record['voltages']
+                if record.get('bound') is not None:
+                    hiPotBoundRow(file2, s1, row, voltages, setup, record['bound'], goodWires, badWires)
+                else:
+                    hiPotRow(file2, s1, row, voltages, setup, goodWires, badWires)
+                checkpoint('row')
 
-                '''# 250V to HI directly on 44 pin module
-                chClose(2, 90)
-                # GND to LO on 44 pin module
-                chClose(2, 93)
-                time.sleep(1)
-                v250 = read(2)
-                # 250V to HI on 44 pin module
-                chOpen(2, 90)'''
+                n += 1
 
-                # Close all 37 pins module channels
-                closeArray = []
-                for row2 in channelTable:
-                    pin37A2 = row2[1]
-                    pin37B2 = row2[2]
-                    closeArray.append(pin37A2)
-                    closeArray.append(pin37B2)
-                chClose(1, closeArray)
+            checkpoint('phase')
+            result = len(badWires) == 0
+            if not result:
+                show("$BHiPot. FAILED!", f"$B{len(badWires)} of {len(channelTable)} pairs are bad!")
+                errorBeep()
+                errorBeep()
+            else:
+                show("HiPot. PASSED!", f"{len(goodWires)} of {len(channelTable)} pairs are good")
+                successBeep()
 
-                # Open the 37 pins module channels that correspond to the pair of wires beeing tested
-                chOpen(1, [pin37A, pin37B])
+            reportWrite(reportSummary("HiPot", result, setup, storeTest['wires']), file2)
+            testResult("HiPot", result, goodWires, badWires, [file, file2])
+            return result
 
-                # Close the 44 pins channel
-                chClose(2, pin44)
+def hiPotOps(row):
+    return hiPotGroupOps([row])
+
+
+def hiPotGroupOps(rows):
+    pins44 = [row[0] for row in rows]
+    pins37 = []
+    for row in rows:
+        pins37 += [row[1], row[2]]
+
+    # Close all 37 pins module channels
+    closeArray = []
+    for row2 in channelTable:
+        pin37A2 = row2[1]
+        pin37B2 = row2[2]
+        closeArray.append(pin37A2)
+        closeArray.append(pin37B2)
+
+    return [('close', 1, closeArray),
+            # Open the 37 pins module channels that correspond to the pair of wires beeing tested
+            ('open', 1, pins37),
+            # Close the 44 pins channel
+            ('close', 2, pins44),
+            ('profile', 'leakage'), ('read', 1, 0), ('read', 2, 1),
+            ('open', 2, pins44)]
+
+
+def hiPotGroupTest(file2, v250, Rtest, Rdmm):
+    # Energize groups of 44 pins channels together against all the other wires. A group test measures the
+    # leakage conductance between the group and everything else, never between two rows of the group, so the
+    # first groups split the rows on each bit of their number: any two rows are apart in at least one of them.
+    # A row's leakage is then bounded by the sum, over those splits, of the smallest conductance measured
+    # across them, plus its leakage to ground. Rows whose bound is too high are narrowed down by halving their
+    # groups, down to the single row test. A leaking row raises the bound of the rows sharing its groups, the
+    # halving stops once it would cost more than testing the rows alone: when the tests reach the row count or
+    # most rows are still above the bound.
+    # Returns the voltages of each row, from its single row test or its smallest group, and the bound on its
+    # leakage conductance (None when the row was tested alone). The voltages of the rows left to the single row
+    # tests are None
+    rows = range(len(channelTable))
+    everything = frozenset(rows)
+    tests = {}
+
+    def measure(group):
+        setContext("HiPot", ','.join(str(i + 1) for i in sorted(group)))
+        show(f"HiPot group ({len(tests) + 1})", f"{len(group)} of {len(channelTable)} channels")
+        voltages = runOps(hiPotGroupOps([channelTable[i] for i in sorted(group)]), 2)
+        R = -(Rtest * voltages[1]) / (voltages[1] - v250)
+        conductance = max(0.0, 1 / R - 1 / Rdmm)
+        tests[group] = (voltages, conductance)
+        fileWrite(file2, f"Group {','.join(f'{channelTable[i][0]:02d}H' for i in sorted(group))}: voltage1={voltages[0]}, voltage2={voltages[1]}, R={R}, conductance={conductance}\n")
+
+    splits = []
+    for bit in range(len(channelTable).bit_length()):
+        group = frozenset(i for i in rows if (i + 1) >> bit & 1)
+        measure(group)
+        splits.append(group)
+
+    def bound(i):
+        terms = []
+        for split in splits:
+            side = split if i in split else everything - split
+            other = everything - side
+            # Any group holding i and nothing from the other side, or all of the other side and not i
+            conductance = min(c for group, (v, c) in tests.items() if (i in group and not group & other) or (i not in group and other <= group))
+            terms.append((conductance, side))
+        terms.append((min(c for group, (v, c) in tests.items() if i in group), everything))
+        return terms
+
+    while True:
+        pending = [i for i in rows if frozenset([i]) not in tests and sum(c for c, side in bound(i)) >= 1 / minIsolationR]
+        if len(pending) == 0:
+            break
+        if len(tests) >= len(channelTable) or 2 * len(pending) > len(channelTable):
+            consoleWrite(f"HiPot groups: {len(pending)} of {len(channelTable)} rows left to the single row tests after {len(tests)} group tests")
+            break
+        i = pending[0]
+        conductance, side = max(bound(i), key=lambda term: term[0])
+        # Halve the smallest group holding i on that side
+        group = sorted(min([g for g in tests if i in g and g <= side] + [side], key=len))
+        half = group[:len(group) // 2]
+        if i not in half:
+            half = group[len(group) // 2:]
+        measure(frozenset(half))
+
+    rowVoltages = []
+    bounds = []
+    for i in rows:
+        smallest = min([group for group in tests if i in group], key=len)
+        if i in pending:
+            rowVoltages.append(None)
+            bounds.append(None)
+        elif len(smallest) == 1:
+            rowVoltages.append(tests[smallest][0])
+            bounds.append(None)
+        else:
+            rowVoltages.append(tests[smallest][0])
+            bounds.append(sum(c for c, side in bound(i)))
+    return rowVoltages, bounds
 
-                valid1, voltage1, expected1 = read(1, v0)
-                valid2, voltage2, expected2 = read(2, v250)
 
-                #input("Press Enter to continue...")
+def measureHiPotRow(i):
+    return runOps(rowOps('hipot', i), 2)
 
-                R = -(Rtest * voltage2) / (voltage2 - v250)
-                r = - (R * Rdmm) / ( R - Rdmm  )
 
+def hiPotRow(file2, s1, row, voltages, setup, goodWires, badWires):
+    v0 = 0
+    v250, Rtest, Vdmm, Rdmm = setup['v250'], setup['Rtest'], setup['Vdmm'], setup['Rdmm']
 
-                fileWrite(file2,f"v0={v0}, voltage1={voltage1}, valid1={valid1},v250={v250},voltage2={voltage2}, valid2={valid2}")
-                fileWrite(file2,f"Vdmm={Vdmm}, Rdmm={Rdmm}, R={R}, r={r}")
-                fileWrite(file2,f"voltage2/Rdmm*1000={voltage2/Rdmm*1000}, voltage2/r*10000={voltage2/r*1000}, voltage2/Rdmm*1000+voltage2/r*1000={voltage2/Rdmm*1000+voltage2/r*1000}, v250-voltage2)/Rtest*1000={(v250-voltage2)/Rtest*1000}")
+    valid1, voltage1, expected1 = check(voltages[0], v0)
+    valid2, voltage2, expected2 = check(voltages[1], v250)
 
-                valid = 'Error'
-                if (valid1 and ( R > Rdmm or r>=minIsolationR)): valid = 'OK'
-                s2 = f"{pin37A:02d}H,{pin37B:02d}H -/- {pin44:02d}H {valid}   {EngNumber(r)}ohm   {EngNumber(voltage2/r)}A leakage  {voltage1:.2f}|{voltage2:.2f} v   ({expected1:.2f}|{expected2:.2f})v "
-                if R > Rdmm:
-                    s2 = f"{pin37A:02d}H,{pin37B:02d}H -/- {pin44:02d}H {valid}   HI ohm    - A leakage  {voltage1:.2f}|{voltage2:.2f} v   ({expected1:.2f}|{expected2:.2f})v "
-                fileWrite(file, s2 + "\n",file2)
-                show(s1, s2)
+    R = -(Rtest * voltage2) / (voltage2 - v250)
+    r = - (R * Rdmm) / ( R - Rdmm  )
 
-                chOpen(2, pin44)
 
-                if valid1 and ( R > Rdmm or r>=minIsolationR):
-                    goodWires.append([pin37A, pin37B, pin44,r])
-                else:
-                    badWires.append([pin37A, pin37B, pin44,r])
-                    errorBeep()
+    fileWrite(file2,f"v0={v0}, voltage1={voltage1}, valid1={valid1},v250={v250},voltage2={voltage2}, valid2={valid2}")
+    fileWrite(file2,f"Vdmm={Vdmm}, Rdmm={Rdmm}, R={R}, r={r}")
+    fileWrite(file2,f"voltage2/Rdmm*1000={voltage2/Rdmm*1000}, voltage2/r*10000={voltage2/r*1000}, voltage2/Rdmm*1000+voltage2/r*1000={voltage2/Rdmm*1000+voltage2/r*1000}, v250-voltage2)/Rtest*1000={(v250-voltage2)/Rtest*1000}")
 
-                n += 1
+    hiPotVerdict(file2, s1, row, valid1, voltage1, voltage2, R, r, setup, goodWires, badWires)
 
-            fileWrite(file, "\n-----------------------------------------------------------------------------------\n",file2)
-            if len(badWires) > 0:
-                show("$BHiPot. FAILED!", f"$B{len(badWires)} of {len(channelTable)} pairs are bad!")
-                errorBeep()
-                errorBeep()
-                fileWrite(file, "\n---> Hi-Pot Test FAILED!\n\n",file2)
-                fileWrite(file, f"{len(goodWires)} of {len(channelTable)} pairs of wires passed the Hi-Pot Test\n",file2)
-
-                fileWrite(file, f"These pair of wires passed:\n\n",file2)
-                fileWrite(file, f"pin37A\tpin37B\t\tpin47\t\t \n",file2)
-                fileWrite(file, f"------\t------\t\t-----\t\t---------\n",file2)
-                for pair in goodWires:
-                    fileWrite(file, f"CH{pair[0]}H\tCH{pair[1]}H\t\tCH{pair[2]}H\t\t{EngNumber(pair[3])}ohm\n",file2)
-
-                fileWrite(file, f"\nThese pair of wires failed:\n\n",file2)
-                fileWrite(file, f"pin37A\tpin37B\t\tpin47\t\t \n",file2)
-                fileWrite(file, f"------\t------\t\t-----\t\t---------\n",file2)
-                for pair in badWires:
-                    fileWrite(file, f"CH{pair[0]}H\tCH{pair[1]}H\t\tCH{pair[2]}H\t\t{EngNumber(pair[3])}ohm\n",file2)
-                result = False
-            else:
-                show("HiPot. PASSED!", f"{len(goodWires)} of {len(channelTable)} pairs are good")
-                successBeep()
-                fileWrite(file, "\n---> Hi-Pot Test PASSED!\n\n",file2)
-                fileWrite(file, f"{len(goodWires)} of {len(channelTable)} pairs of wires passed the Hi-Pot Test\n\n",file2)
 
-                fileWrite(file, f"pin37A\tpin37B\t\tpin47\t\t \n",file2)
-                fileWrite(file, f"------\t------\t\t-----\t\t---------\n",file2)
-                for pair in goodWires:
-                    fileWrite(file, f"CH{pair[0]}H\tCH{pair[1]}H\t\tCH{pair[2]}H\t\t{EngNumber(pair[3])}ohm\n",file2)
-
-                result = True
-
-            fileWrite(file, "\n\n",file2)
-            return result
-
-def pinoutTest():
-    i = datetime.now()
-    with open("reports/pinout_" + i.strftime('%Y_%m_%d_%Hh%Mm%Ss') + f"_{name}.txt", 'w') as file:
-        fileWrite(file, "LSST Camera Vacuum feedthrough Pinout Test\n")
-        fileWrite(file, name + "\n")
-        fileWrite(file, i.strftime('%Y/%m/%d %H:%M:%S\n\n'))
+def hiPotBoundRow(file2, s1, row, voltages, setup, conductance, goodWires, badWires):
+    # Row cleared by the group tests, voltages are those of the smallest group it was in and the isolation
+    # is the lower bound given by the sum of the leakage conductances of its groups
+    v0 = 0
+    v250, Rtest, Rdmm = setup['v250'], setup['Rtest'], setup['Rdmm']
+
+    valid1, voltage1, expected1 = check(voltages[0], v0)
+    valid2, voltage2, expected2 = check(voltages[1], v250)
+
+    R = -(Rtest * voltage2) / (voltage2 - v250)
+    r = - (R * Rdmm) / ( R - Rdmm  )
+    if conductance > 0:
+        r = 1 / conductance
+        R = r * Rdmm / (r + Rdmm)
+
+    fileWrite(file2,f"v0={v0}, voltage1={voltage1}, valid1={valid1},v250={v250},voltage2={voltage2}, valid2={valid2}")
+    fileWrite(file2,f"Group tests leakage conductance={conductance}, R={R}, r={r}")
+
+    hiPotVerdict(file2, s1, row, valid1, voltage1, voltage2, R, r, setup, goodWires, badWires)
+
+
+def hiPotVerdict(file2, s1, row, valid1, voltage1, voltage2, R, r, setup, goodWires, badWires):
+    pin44 = row[0]
+    pin37A = row[1]
+    pin37B = row[2]
+    Rdmm = setup['Rdmm']
+
+    wireValid = valid1 and ( R > Rdmm or r>=setup['minIsolationR'])
+    wire = storeWire(row, pin37A, [voltage1, voltage2], wireValid, r=r,
+                     leakage=None if R > Rdmm else voltage2/r, pin37B=pin37B)
+    reportWrite(reportWire("HiPot", setup, wire), file2, s1)
+    if wireValid:
+        goodWires.append([pin37A, pin37B, pin44,r])
+    else:
+        badWires.append([pin37A, pin37B, pin44,r])
+        errorBeep()
+
+
+def hiPotScanSteps():
+    # Module halves joined, 250V trough RTest and GND on the 44 pins module, GND on the 37 pins module
+    base = [1913, 1923, 2914, 2924, 2091, 2093, 1090, 1093]
+    pins37 = []
+    for row in channelTable:
+        pins37 += [1000 + row[1], 1000 + row[2]]
+
+    # Same relay state as measureHiPotRow(), read once from each module
+    steps = []
+    for row in channelTable:
+        others = [ch for ch in pins37 if ch not in (1000 + row[1], 1000 + row[2])]
+        closed = base + others + [2000 + row[0]]
+        steps.append(closed + [1911])
+        steps.append(closed + [2911])
+    return steps
+
+
+def pinoutTest(scan=False, plan=False, session=None):
+    passed = resumedResult("Pinout")
+    if passed is not None:
+        return passed
+
+    i = testTime("Pinout", session)
+    with testReport("Pinout", "reports/pinout_" + i.strftime('%Y_%m_%d_%Hh%Mm%Ss') + f"_{name}.txt") as file:
+        reportWrite(reportHeader("Pinout", name, i))
 
         show("Pinout Test", "Preparing for test")
+        setContext("Pinout")
 
-        preConfiguration()
+        if session is None:
+            preConfiguration()
+        else:
+            changePhase([1093])
 
-        instr.write('dmm.func = "dcvolts"')
+        setDmm('func', '"dcvolts"')
+        setDmm('autorange', 'dmm.ON')
 
         # Setup common voltages
 
@@ -444,88 +790,503 @@ def pinoutTest():
         badWires = []
 
         tolerance=0.1 #v
+        setup = journalSetup("Pinout", {'tolerance': tolerance})
+        tolerance = setup['tolerance']
+
+        resumedRows = resumed("Pinout", 'rows') or {}
+        if len(resumedRows) > 0 and (scan or plan):
+            consoleWrite(f"Resuming with {len(resumedRows)} of {len(channelTable)} rows measured, the other rows are measured one at a time")
+            scan = plan = False
+
+        rowVoltages = None
+        if scan:
+            show("Pinout Test", "Running scan")
+            readings = runScan(pinoutScanSteps(), 'pinout')
+            rowVoltages = [readings[i:i + 2] for i in range(0, len(readings), 2)]
+        elif plan:
+            rowVoltages = measurePlan("Pinout", planTest("Pinout", compiledPlan['pinout'], closedRelays), 2)
 
         n = 1
         for row in channelTable:
             s1 = f"Pinout Test ({n}/{len(channelTable)})"
-            fileWrite(file, "\n" + s1 + "\n")
-            pin44 = row[0]
-            pin37A = row[1]
-            pin37B = row[2]
-            expected = row[3]
-
-            # Test wire A
-            chClose(1, pin37A)
-            validA, voltageA, expectedA = read(1, expected,tolerance)
-            chOpen(1,pin37A)
-
-            valid = 'Error'
-            if (validA):
-                valid = 'OK'
-                goodWires.append([pin37B,expected,voltageA])
-            else:
-                badWires.append([pin37B,expected,voltageA])
-            s2 = f"{pin37A:02d}H {valid}  {voltageA:.2f} v  ({expectedA:.2f}) v"
-            show(s1, s2)
-            fileWrite(file, s2 + "\n")
-
-            # Test wire B
-            chClose(1, pin37B)
-            validB, voltageB, expectedB = read(1, expected,tolerance)
-            chOpen(1,pin37B)
-            valid = 'Error'
-            if (validB):
-                valid = 'OK'
-                goodWires.append([pin37B,expected,voltageB])
-            else:
-                badWires.append([pin37B,expected,voltageB])
-            s2 = f"{pin37B:02d}H {valid}  {voltageB:.2f} v  ({expectedB:.2f}) v"
-            show(s1, s2)
-            fileWrite(file, s2 + "\n")
+            reportWrite("\n" + s1 + "\n")
+            setContext("Pinout", n)
+
+            record = resumedRows.get(n - 1)
+            if record is None:
+                if rowVoltages is not None:
+                    voltages = rowVoltages[n - 1]
+                else:
+                    voltages = measurePinoutRow(n - 1)
+                record = journalRow("Pinout", n - 1, voltages)
+            voltages = record['voltages']
+            pinoutRow(s1, row, voltages, tolerance, goodWires, badWires)
+            checkpoint('row')
 
             n+=1
 
-        fileWrite(file, "\n-----------------------------------------------------------------------------------\n")
-        if len(badWires) > 0:
+        checkpoint('phase')
+        result = len(badWires) == 0
+        if not result:
             show("$BPinout FAILED!", f"$B{len(badWires)} of {len(channelTable)*2} wires are bad")
             errorBeep()
             errorBeep()
-            fileWrite(file, "\n---> Pinout test FAILED!\n\n")
-            fileWrite(file,
-                      f"{len(goodWires)} of {len(channelTable)*2} wires passed the Pinout Test\n\n")
-
-            fileWrite(file, f"These wires passed:\n\n")
-            fileWrite(file, f"pin37\t\texpected\t\tread\n")
-            fileWrite(file, f"-----\t\t--------\t\t----\n")
-            for pair in goodWires:
-                fileWrite(file, f"CH{pair[0]}H\t\t{EngNumber(pair[1])}v\t\t\t{EngNumber(pair[2])}v\n")
-
-            fileWrite(file, f"\nThese wires failed:\n\n")
-            fileWrite(file, f"pin37\t\texpected\t\tread\n")
-            fileWrite(file, f"-----\t\t--------\t\t----\n")
-            for pair in badWires:
-                fileWrite(file, f"CH{pair[0]}H\t\t{EngNumber(pair[1])}v\t\t\t{EngNumber(pair[2])}v\n")
-            result = False
         else:
             show("Pinout PASSED!", f"{len(goodWires)} of {len(channelTable)*2} wires are good")
             successBeep()
-            fileWrite(file, "\n---> Pinout Test PASSED!\n\n")
-            fileWrite(file,
-                      f"{len(goodWires)} of {len(channelTable)*2} wires passed the Pinout  Test\n\n")
-            fileWrite(file, f"pin37\t\texpected\t\tread\n")
-            fileWrite(file, f"-----\t\t--------\t\t----\n")
-            for pair in goodWires:
-                fileWrite(file, f"CH{pair[0]}H\t\t{EngNumber(pair[1])}v\t\t{EngNumber(pair[2])}v\n")
-            result = True
-
-        fileWrite(file, "\n\n")
+
+        reportWrite(reportSummary("Pinout", result, setup, storeTest['wires']))
+        testResult("Pinout", result, goodWires, badWires, [file])
         return result
 
+def pinoutOps(row, legs=(1, 2)):
+    # Reading 0 is wire A, 1 is wire B
+    ops = []
+    for leg in legs:
+        ops += [('close', 1, [row[leg]]), ('profile', 'pinout'), ('read', 1, leg - 1), ('open', 1, [row[leg]])]
+    return ops
+
+
+def measurePinoutRow(i):
+    return runOps(rowOps('pinout', i), 2)
+
+
+def pinoutRow(s1, row, voltages, tolerance, goodWires, badWires):
+    pin37A = row[1]
+    pin37B = row[2]
+    expected = row[3]
+
+    # Test wire A
+    validA, voltageA, expectedA = check(voltages[0], expected,tolerance)
+
+    wire = storeWire(row, pin37A, [voltageA], validA, expected=expected, voltage=voltageA)
+    if (validA):
+        goodWires.append([pin37A,expected,voltageA])
+    else:
+        badWires.append([pin37A,expected,voltageA])
+    reportWrite(reportWire("Pinout", None, wire), s1=s1)
+
+    # Test wire B
+    validB, voltageB, expectedB = check(voltages[1], expected,tolerance)
+    wire = storeWire(row, pin37B, [voltageB], validB, expected=expected, voltage=voltageB)
+    if (validB):
+        goodWires.append([pin37B,expected,voltageB])
+    else:
+        badWires.append([pin37B,expected,voltageB])
+    reportWrite(reportWire("Pinout", None, wire), s1=s1)
+
+
+def pinoutScanSteps():
+    # Module halves joined, GND on the 37 pins module
+    base = [1913, 1923, 2914, 2924, 1093]
+
+    steps = []
+    for row in channelTable:
+        steps.append(base + [1000 + row[1], 1911])
+        steps.append(base + [1000 + row[2], 1911])
+    return steps
+
+
 # Util functions
 
-def connect(ip):
-    global instr
-    instr = vxi11.Instrument(ip)
+class InstrumentWrapper:
+    # Base for transport wrappers around the instrument, everything not overridden goes to the wrapped one
+    def __init__(self, instrument):
+        self.instrument = instrument
+
+    def write(self, message):
+        self.instrument.write(message)
+
+    def ask(self, message):
+        return self.instrument.ask(message)
+
+    def read_stb(self):
+        return self.instrument.read_stb()
+
+    def flush(self):
+        if isinstance(self.instrument, InstrumentWrapper):
+            self.instrument.flush()
+
+    def close(self):
+        self.instrument.close()
+
+    @property
+    def timeout(self):
+        return self.instrument.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.instrument.timeout = value
+
+
+class CoalescingInstrument(InstrumentWrapper):
+    # Hold back consecutive writes and send them as a single multi-statement TSP message, either in front of
+    # the next query or on an explicit flush()
+    def __init__(self, instrument, maxLength=1024):
+        super().__init__(instrument)
+        self.maxLength = maxLength
+        self.pending = []
+        self.pendingLength = 0
+        self.loadingScript = False
+        self.statements = 0
+        self.messages = 0
+
+    def write(self, message):
+        self.statements += 1
+        if self.loadingScript or message.startswith('loadscript') or '\n' in message:
+            # Script lines and multi-line chunks must reach the instrument as they are
+            self.flush()
+            if message.startswith('loadscript'):
+                self.loadingScript = True
+            elif message.strip() == 'endscript':
+                self.loadingScript = False
+            self.send(message)
+            return
+
+        if self.pendingLength + len(message) + 1 > self.maxLength:
+            self.flush()
+        self.pending.append(message)
+        self.pendingLength += len(message) + 1
+
+    def ask(self, message):
+        self.statements += 1
+        self.messages += 1
+        if len(self.pending) > 0 and self.pendingLength + len(message) <= self.maxLength:
+            message = ' '.join(self.pending + [message])
+            self.pending = []
+            self.pendingLength = 0
+        else:
+            self.flush()
+        return self.instrument.ask(message)
+
+    def read_stb(self):
+        self.flush()
+        return self.instrument.read_stb()
+
+    def flush(self):
+        if len(self.pending) > 0:
+            message = ' '.join(self.pending)
+            self.pending = []
+            self.pendingLength = 0
+            self.send(message)
+        super().flush()
+
+    def send(self, message):
+        self.messages += 1
+        self.instrument.write(message)
+
+    def close(self):
+        self.flush()
+        self.instrument.close()
+
+    def summary(self):
+        return f"{self.statements} commands sent in {self.messages} messages ({self.statements - self.messages} messages saved)"
+
+
+class LockedInstrument(InstrumentWrapper):
+    # Serialize access when the instrument connection is shared between threads
+    def __init__(self, instrument):
+        super().__init__(instrument)
+        self.lock = threading.RLock()
+
+    def write(self, message):
+        with self.lock:
+            self.instrument.write(message)
+
+    def ask(self, message):
+        with self.lock:
+            return self.instrument.ask(message)
+
+    def read_stb(self):
+        with self.lock:
+            return self.instrument.read_stb()
+
+    def flush(self):
+        with self.lock:
+            super().flush()
+
+    def close(self):
+        with self.lock:
+            self.instrument.close()
+
+
+class TracingInstrument(InstrumentWrapper):
+    # Record the start, duration, command, test phase and row, and calling function of every call to the
+    # instrument. Only inserted when tracing, see connect()
+    def __init__(self, instrument):
+        super().__init__(instrument)
+        self.start = time.perf_counter()
+        self.events = []
+
+    def write(self, message):
+        self.trace('write', message, self.instrument.write, message)
+
+    def ask(self, message):
+        return self.trace('ask', message, self.instrument.ask, message)
+
+    def read_stb(self):
+        return self.trace('stb', 'read_stb', self.instrument.read_stb)
+
+    def flush(self):
+        self.trace('flush', 'flush', super().flush)
+
+    def trace(self, kind, command, call, *args):
+        # The caller is the first function up the stack that is not an instrument wrapper method
+        frame = sys._getframe(2)
+        while isinstance(frame.f_locals.get('self'), InstrumentWrapper):
+            frame = frame.f_back
+        begin = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            end = time.perf_counter()
+            self.events.append((kind, command, begin - self.start, end - begin, testPhase, testRow,
+                                frame.f_code.co_name, threading.current_thread().name))
+
+    def export(self, path):
+        # Chrome trace-event format, for chrome://tracing or https://ui.perfetto.dev
+        events = []
+        for kind, command, begin, duration, phase, row, caller, thread in self.events:
+            events.append({'name': command, 'cat': kind, 'ph': 'X', 'ts': begin * 1e6, 'dur': duration * 1e6,
+                           'pid': 1, 'tid': thread, 'args': {'phase': phase, 'row': row, 'caller': caller}})
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+    def summary(self, top=10):
+        # Commands grouped with their numbers replaced by '#', by total time
+        commands = {}
+        for kind, command, begin, duration, phase, row, caller, thread in self.events:
+            key = (kind, re.sub(r'\d+(\.\d+)?(e[-+]?\d+)?', '#', command)[:60], caller)
+            count, total = commands.get(key, (0, 0.0))
+            commands[key] = (count + 1, total + duration)
+        elapsed = sum(event[3] for event in self.events)
+        lines = [f"{len(self.events)} instrument calls, {EngNumber(elapsed)}s",
+                 f"{'total':>9} {'share':>6} {'calls':>6} {'mean':>9}  {'caller':<22}command"]
+        for (kind, command, caller), (count, total) in sorted(commands.items(), key=lambda item: -item[1][1])[:top]:
+            lines.append(f"{str(EngNumber(total)) + 's':>9} {total / elapsed if elapsed > 0 else 0:>6.1%} {count:>6} "
+                         f"{str(EngNumber(total / count)) + 's':>9}  {caller:<22}{kind} {command}")
+        return '\n'.join(lines)
+
+
+class RecordingInstrument(InstrumentWrapper):
+    # Save every call and response to a transcript, one JSON object per line: {"w": command},
+    # {"a": query, "r": response} or {"s": status byte}. Calls from the display thread are marked with "d" as
+    # their timing, so their place in the transcript, changes from run to run
+    def __init__(self, instrument, path):
+        super().__init__(instrument)
+        self.file = open(path, 'w')
+
+    def write(self, message):
+        self.instrument.write(message)
+        self.save({'w': message})
+
+    def ask(self, message):
+        response = self.instrument.ask(message)
+        self.save({'a': message, 'r': response})
+        return response
+
+    def read_stb(self):
+        stb = self.instrument.read_stb()
+        self.save({'s': stb})
+        return stb
+
+    def save(self, call):
+        if isinstance(threading.current_thread(), DisplayWorker):
+            call['d'] = 1
+        self.file.write(json.dumps(call) + '\n')
+
+    def close(self):
+        self.instrument.close()
+        self.file.close()
+
+
+class ReplayInstrument:
+    # Serve the responses of a transcript saved with --record instead of the instrument. The calls must come
+    # in the recorded order, display thread calls are not checked
+    def __init__(self, path):
+        self.calls = []
+        with open(path, 'r') as file:
+            for line in file:
+                call = json.loads(line)
+                if 'd' not in call:
+                    self.calls.append(call)
+        self.position = 0
+        self.timeout = 10
+
+    def next(self, kind, message=None):
+        if self.position >= len(self.calls):
+            raise Exception(f"Replay: {message or kind} sent after the end of the transcript")
+        call = self.calls[self.position]
+        self.position += 1
+        if kind not in call or (message is not None and call[kind] != message):
+            raise Exception(f"Replay: call {self.position} is {message or kind}, {call} was recorded (are the options those of the recorded run?)")
+        return call
+
+    def write(self, message):
+        if not isinstance(threading.current_thread(), DisplayWorker):
+            self.next('w', message)
+
+    def ask(self, message):
+        return self.next('a', message)['r']
+
+    def read_stb(self):
+        return self.next('s')['s']
+
+    def close(self):
+        pass
+
+    def summary(self):
+        return f"Replayed {self.position} of {len(self.calls)} recorded calls"
+
+
+class SocketInstrument:
+    # TSP over a raw TCP connection to the instrument (port 5025, or the one in ip as host:port). Commands are
+    # newline terminated and writes don't wait for the instrument, queries read up to the next newline
+    def __init__(self, ip, timeout=10):
+        host, _, port = ip.partition(':')
+        self.socket = socket.create_connection((host, int(port or 5025)), timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.received = b''
+
+    @property
+    def timeout(self):
+        return self.socket.gettimeout()
+
+    @timeout.setter
+    def timeout(self, value):
+        self.socket.settimeout(value)
+
+    def write(self, message):
+        self.socket.sendall(message.encode() + b'\n')
+
+    def ask(self, message):
+        self.write(message)
+        while b'\n' not in self.received:
+            data = self.socket.recv(65536)
+            if len(data) == 0:
+                raise Exception("Connection closed by the instrument")
+            self.received += data
+        line, _, self.received = self.received.partition(b'\n')
+        return line.decode().rstrip('\r')
+
+    def read_stb(self):
+        # No device_readstb without VXI-11, the status byte is read with a query
+        return int(float(self.ask('print(status.condition)')))
+
+    def close(self):
+        self.socket.close()
+
+
+class DisplayWorker(threading.Thread):
+    # Refresh the front panel from a background thread at most maxRate times per second. Only the latest
+    # message is kept, the ones posted in between are dropped
+    def __init__(self, instrument, maxRate, ownsLink=False):
+        super().__init__(daemon=True)
+        self.instrument = instrument
+        self.interval = 1.0 / maxRate
+        self.ownsLink = ownsLink
+        self.condition = threading.Condition()
+        self.message = None
+        self.stopping = False
+        self.sent = 0
+        self.dropped = 0
+
+    def post(self, message):
+        with self.condition:
+            if self.message is not None:
+                self.dropped += 1
+            self.message = message
+            self.condition.notify()
+
+    def run(self):
+        last = 0
+        while True:
+            with self.condition:
+                while self.message is None and not self.stopping:
+                    self.condition.wait()
+                if self.message is None:
+                    return
+                wait = last + self.interval - time.monotonic()
+                if wait > 0 and not self.stopping:
+                    self.condition.wait(wait)
+                    continue
+                message = self.message
+                self.message = None
+            self.instrument.write(message)
+            self.sent += 1
+            last = time.monotonic()
+
+    def stop(self):
+        # The last message posted is always shown
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.join()
+        if self.ownsLink:
+            self.instrument.close()
+
+
+def connect(ip, coalesce=False, simulation=None, trace=False, record=None, replay=None, link='vxi11'):
+    # simulation holds the keithleySim.SimulatedInstrument arguments when the 3700A at ip is simulated, replay
+    # a transcript saved with record. Transcripts hold the commands before they are coalesced
+    global instr, simulator, transport
+    if replay is not None:
+        transport = 'replay'
+        instr = ReplayInstrument(replay)
+        coalesce = False
+    elif simulation is not None:
+        transport = 'sim'
+        simulator = keithleySim.SimulatedInstrument(**simulation)
+        instr = simulator
+    else:
+        transport = link
+        instr = openInstrument(ip)
+    if coalesce:
+        instr = CoalescingInstrument(instr)
+    if record is not None:
+        instr = RecordingInstrument(instr, record)
+    if trace:
+        instr = TracingInstrument(instr)
+
+
+def openInstrument(ip):
+    if transport == 'socket':
+        return SocketInstrument(ip)
+    return vxi11.Instrument(ip)
+
+
+def startDisplay(ip, maxRate, separate=False):
+    # The simulator and replayed transcripts only have one link
+    global instr, displayWorker
+    if separate and transport in ('vxi11', 'socket'):
+        displayWorker = DisplayWorker(openInstrument(ip), maxRate, ownsLink=True)
+    else:
+        instr = LockedInstrument(instr)
+        displayWorker = DisplayWorker(instr, maxRate)
+    displayWorker.start()
+
+
+def stopDisplay():
+    global displayWorker
+    if displayWorker is not None:
+        displayWorker.stop()
+        print(f"Display updated {displayWorker.sent} times ({displayWorker.dropped} updates dropped)")
+        displayWorker = None
+
+
+def findWrapper(wrapperClass):
+    wrapper = instr
+    while isinstance(wrapper, InstrumentWrapper):
+        if isinstance(wrapper, wrapperClass):
+            return wrapper
+        wrapper = wrapper.instrument
+    return None
+
+
+def flush():
+    # Make sure every command held back by the transport has reached the instrument
+    if isinstance(instr, InstrumentWrapper):
+        instr.flush()
 
 
 def write(script):
@@ -535,71 +1296,593 @@ def write(script):
 
 
 def readCsv(filePath):
-    global rawTable, channelTable
+    # Load the mapping and its compiled plan from the plan cache, or parse, validate and compile it
+    global rawTable, channelTable, compiledPlan, mappingFile, mappingHash
+    print(filePath)
+    with open(filePath, 'rb') as csvfile:
+        content = csvfile.read()
+    mappingFile = os.path.basename(filePath)
+    mappingHash = hashlib.sha256(content).hexdigest()
+    cache = os.path.join(planCache, hashlib.sha256(planVersion.encode() + content).hexdigest() + '.json')
+    if os.path.exists(cache):
+        # A plan that does not load (left over from an older version or damaged) is compiled again
+        try:
+            with open(cache, 'r') as file:
+                compiled = json.load(file)
+            rawTable, channelTable, compiledPlan = compiled['rawTable'], compiled['channelTable'], compiled['plan']
+            return
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
     rawTable = []
     channelTable = []
-    print(filePath)
-    with open(filePath, 'r') as csvfile:
-        reader = csv.reader(csvfile, delimiter=',')
-        for i, row in enumerate(reader):
-            if i == 0:
-                continue
-            if row[0] != '':
-                rawTable.append(row)
+    problems = []
+    reader = csv.reader(content.decode().splitlines(), delimiter=',')
+    for i, row in enumerate(reader):
+        if i == 0:
+            continue
+        if len(row) > 0 and row[0] != '':
+            rawTable.append(row)
+            try:
                 channelRow = [row[0], row[2], row[3],row[5]]
                 for n, col in enumerate(channelRow):
                     channelRow[n] = int(col.replace("CH", "").replace("Ch", "").replace("H", ""))
-                channelTable.append(channelRow)
-        # print ((channelTable))
+            except (IndexError, ValueError):
+                problems.append(f"line {i + 1}: 44 pins, 37 pins A and B channels and expected voltage expected, {row} found")
+                continue
+            channelTable.append(channelRow)
+    problems += validateMapping(channelTable)
+    if len(problems) > 0:
+        raise Exception(f"Invalid mapping {filePath}:\n    " + '\n    '.join(problems))
+
+    compiledPlan = compilePlan()
+    # Written next to its place and moved there, so that the other testers sharing plans/ never load half a plan
+    os.makedirs(planCache, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=planCache, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w') as file:
+            json.dump({'mapping': filePath, 'rawTable': rawTable, 'channelTable': channelTable, 'plan': compiledPlan}, file)
+        os.replace(temporary, cache)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def validateMapping(table):
+    problems = []
+    pins44 = [row[0] for row in table]
+    pins37 = [row[1] for row in table] + [row[2] for row in table]
+    for pins, module in ((pins44, '44 pins'), (pins37, '37 pins')):
+        for ch in sorted(set(pins)):
+            if pins.count(ch) > 1:
+                problems.append(f"{module} channel CH{ch}H used {pins.count(ch)} times")
+            if ch < 1 or ch > maxPinChannel:
+                problems.append(f"{module} channel CH{ch}H out of the 3722 pin channels (CH1H to CH{maxPinChannel}H)")
+    return problems
+
+
+def compilePlan():
+    # The operations of each channelTable row of each test: the variants the planner can choose from, the first
+    # one in the mapping order
+    return {'continuity': continuityVariants(), 'bridge': bridgeVariants(), 'hipot': hiPotVariants(),
+            'pinout': pinoutVariants()}
+
+
+def rowOps(test, i):
+    return compiledPlan[test][i][0]
 
 
 def read(slot, expected=None, tolerance=0.05):
 
+    if relayTracking:
+        # Backplane channels stay closed between readings, only one module at a time can be on the DMM
+        chOpen(3 - slot, 911)
     chClose(slot, 911)
 
     read = (instr.ask('print(dmm.measure())'))
     value = float(read)
-    checkError()
-    chOpen(slot, 911)
+    uncheckedReadings.append(f"{readingTag()} slot {slot}: {value}")
+    errorCheckpoint('reading')
+    if not relayTracking:
+        chOpen(slot, 911)
 
     if expected is not None:
-        valid = abs(expected - value) < tolerance
-        return (valid, value, expected)
+        return check(value, expected, tolerance)
 
     return value
 
 
+def check(value, expected, tolerance=0.05):
+    valid = abs(expected - value) < tolerance
+    return (valid, value, expected)
+
+
+def waitStable(slot):
+    # Read until two consecutive readings agree within settleTolerance, or settleTimeout seconds
+    start = time.monotonic()
+    previous = read(slot)
+    while True:
+        value = read(slot)
+        if abs(value - previous) < settleTolerance or time.monotonic() - start > settleTimeout:
+            return value
+        previous = value
+
+
+def profileSettings(name):
+    # DMM attributes and values of a profile, or of profileOverride when set
+    profile = profiles[profileOverride or name]
+    settings = {'nplc': profile['nplc']}
+    if profile['range'] is not None:
+        settings['range'] = profile['range']
+    if profile['filter'] > 1:
+        settings['filter.count'] = profile['filter']
+        settings['filter.enable'] = 'dmm.ON'
+    else:
+        settings['filter.enable'] = 'dmm.OFF'
+    settings['autodelay'] = 'dmm.AUTODELAY_ONCE' if profile['autodelay'] else 'dmm.AUTODELAY_OFF'
+    return settings
+
+
+def applyProfile(name):
+    for setting, value in profileSettings(name).items():
+        setDmm(setting, value)
+
+
+def setDmm(setting, value):
+    # Only write the DMM settings that change
+    if dmmSettings.get(setting) != value:
+        instr.write(f'dmm.{setting} = {value}')
+        # Each DMM function keeps its own settings, those of the new one are not known
+        if setting == 'func' and 'func' in dmmSettings:
+            dmmSettings.clear()
+        dmmSettings[setting] = value
+        # Setting a range turns autorange off, turning autorange on changes the range
+        if setting == 'range':
+            dmmSettings.pop('autorange', None)
+        elif setting == 'autorange':
+            dmmSettings.pop('range', None)
+
+
+def loadProfiles(path):
+    with open(path, 'r') as file:
+        for name, profile in json.load(file).items():
+            profiles[name].update(profile)
+    print(f"DMM profiles loaded from {path}")
+
+
+def calibrationSetups():
+    # Range, relay operations and slot of a reading representative of each profile, from the preConfiguration()
+    # state. The leakage reading needs the 250V supply on
+    row = channelTable[0]
+    continuity = [('close', 2, [89, 93]), ('close', 1, [89, 93]), ('close', 2, [row[0]])]
+    return {'supply': (7, [('close', 2, [89, 93])], 2),
+            'baseline': (7, continuity, 2),
+            'bridge': (7, continuity + [('close', 1, [row[1]])], 2),
+            'leakage': (260, [('close', 2, [91, 93])], 2),
+            'pinout': (None, [('close', 1, [93, row[1]])], 1)}
+
+
+def calibrate(path, samples=10):
+    # For each profile, try the NPLC and filter count candidates from the fastest and keep the first whose noise
+    # (3 sigma) plus offset from the most precise candidate is within calibrationMargin of the tolerance.
+    # Range and autodelay are kept
+    candidates = [(nplc, count) for nplc in calibrationNplc for count in calibrationFilter]
+    candidates.sort(key=lambda candidate: (candidate[0] * candidate[1], candidate[1]))
+
+    def sample(name, slot, nplc, count):
+        profiles[name].update(nplc=nplc, filter=count)
+        applyProfile(name)
+        values = [read(slot) for n in range(samples)]
+        return statistics.mean(values), statistics.stdev(values)
+
+    for name, (dmmRange, ops, slot) in calibrationSetups().items():
+        show("Calibration", name)
+        setContext("Calibration", name)
+        preConfiguration()
+        setDmm('func', '"dcvolts"')
+        if dmmRange is not None:
+            setDmm('range', dmmRange)
+        runOps(ops, 0)
+
+        reference = sample(name, slot, *candidates[-1])[0]
+        limit = calibrationMargin * profileTolerance[name]
+        for nplc, count in candidates:
+            mean, sigma = sample(name, slot, nplc, count)
+            error = 3 * sigma + abs(mean - reference)
+            print(f"{name}: nplc {nplc}, filter {count}: {EngNumber(mean)}v, error {EngNumber(error)}v (limit {EngNumber(limit)}v)")
+            if error <= limit:
+                break
+        else:
+            print(f"{name}: no candidate within the limit, keeping the most precise one")
+        checkpoint('phase')
+        print(f"{name}: nplc {nplc}, filter {count}, {EngNumber(nplc * count / lineFrequency)}s per reading")
+
+    with open(path, 'w') as file:
+        json.dump(profiles, file, indent=4)
+    print(f"DMM profiles saved to {path}")
+
+
+def runOps(ops, count):
+    voltages = [None] * count
+    for op in ops:
+        if op[0] == 'read':
+            voltages[op[2]] = read(op[1])
+        elif op[0] == 'profile':
+            applyProfile(op[1])
+        elif op[0] == 'close':
+            chClose(op[1], op[2])
+        else:
+            chOpen(op[1], op[2])
+    return voltages
+
+
+def tspOps(ops, settings):
+    # Readings go to vfBuf in the order of the operations. settings holds the DMM settings when the script
+    # reaches these operations and is updated, only the profile settings that change are written
+    line = ''
+    for op in ops:
+        if op[0] == 'read':
+            line += tspRead(op[1])
+        elif op[0] == 'profile':
+            for setting, value in profileSettings(op[1]).items():
+                if settings.get(setting) != value:
+                    line += f'dmm.{setting} = {value} '
+                    settings[setting] = value
+        else:
+            adds = ','.join(str(op[1] * 1000 + ch) for ch in op[2])
+            line += f'channel.{op[0]}("{adds}") '
+    return line
+
+
+def tspRead(slot):
+    return f'channel.close("{slot * 1000 + 911}") dmm.measure(vfBuf) channel.open("{slot * 1000 + 911}") '
+
+
+def loadScript(name, lines):
+    instr.write(f'loadscript {name}')
+    for line in lines:
+        instr.write(line)
+    instr.write('endscript')
+
+
+def runScript(name, buffer, count):
+    if relayTracking:
+        # The script switches the backplane itself
+        chOpen(1, 911)
+        chOpen(2, 911)
+
+    # The script runs to completion before the instrument answers, so allow ~0.2s per reading
+    timeout = instr.timeout
+    instr.timeout = max(timeout, 10 + 0.2 * count)
+    try:
+        instr.write(f'{name}.run()')
+        values = instr.ask(f'printbuffer(1, {buffer}.n, {buffer})')
+    finally:
+        instr.timeout = timeout
+    uncheckedReadings.append(f"{readingTag()} {name} script: {count} readings")
+    checkError()
+    if relayTracking:
+        syncRelays()
+
+    readings = [float(value) for value in values.split(',')]
+    if len(readings) != count:
+        raise Exception(f"{name} returned {len(readings)} readings, {count} expected")
+    return readings
+
+
+def runScan(steps, profile):
+    # Let the 3700A scanner sequence the relays and trigger the DMM. Each step is a channel pattern with the
+    # complete set of closed channels, so only the differences between consecutive steps are switched. The
+    # scan configuration takes the DMM settings of the profile
+    applyProfile(profile)
+    common = set(steps[0]).intersection(*steps[1:])
+
+    lines = [f'vfBuf = dmm.makebuffer({len(steps)})',
+             'dmm.configure.set("vfscan")',
+             'scan.reset()',
+             'scan.mode = scan.MODE_OPEN_SELECTIVE']
+    for n, step in enumerate(steps, 1):
+        image = ','.join(str(ch) for ch in step)
+        lines.append(f'channel.pattern.setimage("{image}", "vfP{n}") scan.add("vfP{n}", "vfscan")')
+    lines.append('scan.execute(vfBuf)')
+    # The scanner opens the last step when done, restore the channels shared by every step
+    lines.append('channel.close("' + ','.join(str(ch) for ch in sorted(common)) + '")')
+
+    loadScript('vacFeedScan', lines)
+    return runScript('vacFeedScan', 'vfBuf', len(steps))
+
+
+def simulateOps(ops, closed, dmm, reorder=True):
+    # Count the relay actuations needed to run ops from the closed channels, and the DMM autodelays from the dmm
+    # settings and pending autodelay, both updated. Consecutive readings do not depend on each other: with relay
+    # tracking they are reordered to start with the module already connected to the DMM
+    actuations = 0
+    autodelays = 0
+    planned = []
+    n = 0
+    while n < len(ops):
+        op = ops[n]
+        if op[0] == 'profile':
+            for setting, value in profileSettings(op[1]).items():
+                if dmm['settings'].get(setting) != value:
+                    dmm['settings'][setting] = value
+                    dmm['pending'] = True
+            planned.append(op)
+            n += 1
+            continue
+        if op[0] != 'read':
+            channels = set(op[1] * 1000 + ch for ch in op[2])
+            if op[0] == 'close':
+                actuations += len(channels - closed)
+                closed |= channels
+            else:
+                actuations += len(channels & closed)
+                closed -= channels
+            planned.append(op)
+            n += 1
+            continue
+
+        group = []
+        while n < len(ops) and ops[n][0] == 'read':
+            group.append(ops[n])
+            n += 1
+        if relayTracking and reorder:
+            group.sort(key=lambda op: op[1] * 1000 + 911 not in closed)
+        for op in group:
+            if relayTracking:
+                backplane = op[1] * 1000 + 911
+                other = (3 - op[1]) * 1000 + 911
+                actuations += (other in closed) + (backplane not in closed)
+                closed.discard(other)
+                closed.add(backplane)
+            else:
+                actuations += 2
+            if dmm['pending'] and dmm['settings'].get('autodelay') == 'dmm.AUTODELAY_ONCE':
+                autodelays += 1
+            dmm['pending'] = False
+            planned.append(op)
+
+    return actuations, autodelays, planned
+
+
+def planTest(phase, variants, closed):
+    # variants holds, for each channelTable row, the possible operation sequences for that row (e.g. both
+    # orders of the A and B wires). Greedily run next the row and variant that takes the least relay actuation
+    # and DMM autodelay time. Returns (row index, operations) in the order they should run
+    csvClosed = set(closed)
+    csvDmm = {'settings': dict(dmmSettings), 'pending': False}
+    csvActuations = 0
+    csvAutodelays = 0
+    for rowVariants in variants:
+        rowActuations, rowAutodelays, planned = simulateOps(rowVariants[0], csvClosed, csvDmm, reorder=False)
+        csvActuations += rowActuations
+        csvAutodelays += rowAutodelays
+
+    closed = set(closed)
+    dmm = {'settings': dict(dmmSettings), 'pending': False}
+    remaining = list(range(len(variants)))
+    plan = []
+    actuations = 0
+    autodelays = 0
+    while len(remaining) > 0:
+        best = None
+        for i in remaining:
+            for ops in variants[i]:
+                rowActuations, rowAutodelays, planned = simulateOps(ops, set(closed), {'settings': dict(dmm['settings']), 'pending': dmm['pending']})
+                cost = rowActuations * relayActuationTime + rowAutodelays * autodelayTime
+                if best is None or cost < best[0]:
+                    best = (cost, i, planned)
+        cost, i, planned = best
+        rowActuations, rowAutodelays, planned = simulateOps(planned, closed, dmm, reorder=False)
+        actuations += rowActuations
+        autodelays += rowAutodelays
+        remaining.remove(i)
+        plan.append((i, planned))
+
+    saved = (csvActuations - actuations) * relayActuationTime + (csvAutodelays - autodelays) * autodelayTime
+    consoleWrite(f"{phase} plan: {actuations} relay actuations and {autodelays} DMM autodelays, {csvActuations} and {csvAutodelays} in CSV order ({EngNumber(saved)}s saved)")
+    return plan
+
+
+def measurePlan(phase, plan, count):
+    voltages = [None] * len(plan)
+    for i, ops in plan:
+        setContext(phase, i + 1)
+        voltages[i] = runOps(ops, count)
+    return voltages
+
+
+def continuityVariants():
+    return [[continuityOps(row, (1, 2)), continuityOps(row, (2, 1))] for row in channelTable]
+
+
+def bridgeVariants():
+    return [[bridgeOps(row, (1, 2)), bridgeOps(row, (2, 1))] for row in channelTable]
+
+
+def hiPotVariants():
+    return [[hiPotOps(row)] for row in channelTable]
+
+
+def pinoutVariants():
+    return [[pinoutOps(row, (1, 2)), pinoutOps(row, (2, 1))] for row in channelTable]
+
+
+def estimatePlans():
+    # Channels closed when the row loop of each test starts
+    planTest("Cont. Load", compiledPlan['continuity'], {1913, 1923, 2914, 2924, 2089, 2093, 1089, 1093})
+    planTest("HiPot", compiledPlan['hipot'], {1913, 1923, 2914, 2924, 2091, 2093, 1090, 1093})
+    planTest("Pinout", compiledPlan['pinout'], {1913, 1923, 2914, 2924, 1093})
+
+
+# Simulator counts and time kinds printed by dryRun()
+dryRunCounts = [('writes', 'writes'), ('asks', 'queries'), ('stb', 'status byte reads'),
+                ('relayOps', 'relay operations'), ('readings', 'DMM readings'), ('statements', 'TSP statements')]
+dryRunTimes = [('write', 'writes'), ('ask', 'queries'), ('stb', 'status byte reads'), ('relay', 'relay actuations'),
+               ('reading', 'DMM integration'), ('autodelay', 'DMM autodelay'), ('statement', 'TSP execution'),
+               ('delay', 'TSP delays'), ('beep', 'beeper'), ('reset', 'instrument reset')]
+
+
+def dryRun(mapping, tests, options, session, faults=(), latencies=None):
+    # Run the tests on the simulated 3700A, from a scratch directory and without the journal and results store,
+    # and print the operations each one sends and the time they would take on the bench with the latencies of
+    # keithleySim.latency updated with latencies
+    global resultsDb, name
+    resultsDb = None
+    name = options['name'] if options['name'] is not None else 'dry-run'
+    connect(None, options['coalesce'], {'mapping': mapping, 'faults': list(faults), 'latencies': latencies})
+    columns = []
+
+    def measure(title, run):
+        counts = dict(simulator.stats)
+        times = dict(simulator.times)
+        run()
+        if isinstance(instr, InstrumentWrapper):
+            instr.flush()
+        columns.append((title, {key: simulator.stats[key] - counts.get(key, 0) for key in simulator.stats},
+                        {key: simulator.times[key] - times.get(key, 0.0) for key in simulator.times}))
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        os.makedirs('reports')
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                measure('setup', preConfiguration)
+                for test in tests:
+                    measure({'hipot': 'HiPot', 'continuity': 'Cont. Load', 'pinout': 'Pinout'}[test],
+                            lambda: runTest(test, options, session))
+                flushReports()
+        finally:
+            os.chdir(cwd)
+    columns.append(('total', {key: sum(column[1].get(key, 0) for column in columns) for key, _ in dryRunCounts},
+                    {key: sum(column[2].get(key, 0.0) for column in columns) for key, _ in dryRunTimes}))
+
+    print(f"Dry run of {os.path.basename(mapping)}, {len(channelTable)} rows, latencies: " +
+          ', '.join(f"{kind} {EngNumber(seconds)}s" for kind, seconds in simulator.latency.items()))
+    print(f"\n{'':<20}" + ''.join(f"{title:>12}" for title, _, _ in columns))
+    for key, label in dryRunCounts:
+        print(f"{label:<20}" + ''.join(f"{counts.get(key, 0):>12}" for _, counts, _ in columns))
+    print("\nestimated time")
+    for key, label in dryRunTimes:
+        if any(times.get(key, 0.0) > 0 for _, _, times in columns):
+            print(f"{label:<20}" + ''.join(f"{times.get(key, 0.0):>11.2f}s" for _, _, times in columns))
+    print(f"{'total':<20}" + ''.join(f"{sum(times.values()):>11.2f}s" for _, _, times in columns))
+
+    if sum(columns[-1][2].values()) > 0:
+        print()
+        for title, _, times in columns[:-1]:
+            if sum(times.values()) > 0:
+                key = max(times, key=times.get)
+                print(f"{title}: {times[key] / sum(times.values()):.0%} of {sum(times.values()):.2f}s in "
+                      f"{dict(dryRunTimes)[key]}")
+
+
 def printClosed():
     print(instr.ask('print(channel.getclose("allslots"))'))
 
 
 def checkError():
     error = float(instr.ask('print(errorqueue.count)'))
+    if error > 0 and len(uncheckedReadings) > 0:
+        consoleWrite("\nERROR raised by one of these readings:")
+        for reading in uncheckedReadings:
+            consoleWrite("    " + reading)
     while error > 0:
-        print("\nERROR:")
-        print(instr.ask('print(errorqueue.next())'))
+        consoleWrite("\nERROR:")
+        consoleWrite(instr.ask('print(errorqueue.next())'))
         error = float(instr.ask('print(errorqueue.count)'))
+    uncheckedReadings.clear()
+
+
+def checkpoint(level):
+    errorCheckpoint(level)
+    if relayTracking and relayVerify != 'never' and errorLevels.index(level) >= errorLevels.index(relayVerify):
+        verifyRelays()
+    if level == 'phase':
+        # The reports catch up between the phases, when the measurements don't wait on them
+        flushReports()
+
+
+def errorCheckpoint(level):
+    # Called after each reading, row and phase, checks the error queue if errorCheck asks for it at that level
+    if len(uncheckedReadings) == 0:
+        return
+    if errorCheck == 'status':
+        # Error Available bit of the status byte, only drain the queue when it is set
+        if level == 'reading':
+            return
+        if instr.read_stb() & 4:
+            checkError()
+        else:
+            uncheckedReadings.clear()
+    elif errorLevels.index(level) >= errorLevels.index(errorCheck):
+        checkError()
+
+
+def setContext(phase, row=None):
+    global testPhase, testRow
+    testPhase = phase
+    testRow = row
+    if isinstance(row, int):
+        publish({'event': 'row', 'test': phase, 'row': row, 'rows': len(channelTable)})
+
+
+def readingTag():
+    if testRow is None:
+        return f"{testPhase}"
+    return f"{testPhase} row {testRow}"
 
 
 def chClose(module, channels):
     if type(channels) is not list: channels = [channels]
 
-    for n, ch in enumerate(channels):
-        channels[n] = str(module * 1000 + ch)
-    adds = ','.join(channels)
+    channels = [module * 1000 + ch for ch in channels]
+    if relayTracking:
+        channels = [ch for ch in channels if ch not in closedRelays]
+        if len(channels) == 0:
+            return
+        closedRelays.update(channels)
+    adds = ','.join(str(ch) for ch in channels)
     instr.write(f'channel.close("{adds}")')
 
 
 def chOpen(module, channels):
     if type(channels) is not list: channels = [channels]
 
-    for n, ch in enumerate(channels):
-        channels[n] = str(module * 1000 + ch)
-    adds = ','.join(channels)
+    channels = [module * 1000 + ch for ch in channels]
+    if relayTracking:
+        channels = [ch for ch in channels if ch in closedRelays]
+        if len(channels) == 0:
+            return
+        closedRelays.difference_update(channels)
+    adds = ','.join(str(ch) for ch in channels)
 
     instr.write(f'channel.open("{adds}")')
 
 
+def getClosed():
+    closed = instr.ask('print(channel.getclose("allslots"))').strip()
+    if closed == 'nil':
+        return set()
+    return set(int(ch) for ch in closed.split(';'))
+
+
+def syncRelays():
+    closedRelays.clear()
+    closedRelays.update(getClosed())
+
+
+def verifyRelays():
+    closed = getClosed()
+    if closed != closedRelays:
+        consoleWrite("\nWARNING: relay state out of sync")
+        consoleWrite(f"    expected closed: {','.join(str(ch) for ch in sorted(closedRelays - closed))}")
+        consoleWrite(f"    expected open: {','.join(str(ch) for ch in sorted(closed - closedRelays))}")
+        closedRelays.clear()
+        closedRelays.update(closed)
+
+
 def show(string1, string2='',c_print=False):
     string2 = string2.replace("Error", 'X').replace('OK', 'V')
 
@@ -609,7 +1892,11 @@ def show(string1, string2='',c_print=False):
     display.setcursor(2, 1)
     display.settext("{string2}")'''
 
-    write(a)
+    if displayWorker is not None:
+        displayWorker.post(' '.join(line.strip() for line in a.split("\n")))
+    else:
+        write(a)
+    publish({'event': 'status', 'lines': [string1.replace("$B", ""), string2.replace("$B", "")]})
     n1 = 20
     n2 = 32
     # print()
@@ -621,11 +1908,436 @@ def show(string1, string2='',c_print=False):
         print(string2.replace("$B",""))
 
 
+def emit(record):
+    post('listeners', record)
+
+
+def testResult(test, passed, goodWires, badWires, files, error=None):
+    # Write the report of a test, files[0], from the stored test and emit its result with its good and bad wires
+    # as dictionaries. Tests that ran to the end are done for a resumed run
+    if error is None:
+        journalWrite({'test': test, 'passed': passed})
+    post('text', files[0], formatReport(test, name, storeTest['time'], passed, error, storeTest['setup'],
+                                        storeTest['wires'], len(channelTable)))
+    storeResults(test, passed, error, files)
+    publish({'event': 'result', 'test': test, 'name': name, 'passed': passed, 'error': error,
+             'good': len(goodWires), 'bad': len(badWires)})
+    fields = wireFields[test]
+    emit({'record': 'test', 'test': test, 'name': name, 'passed': passed, 'error': error,
+          'good': [dict(zip(fields, wire)) for wire in goodWires],
+          'bad': [dict(zip(fields, wire)) for wire in badWires],
+          'reports': [file.name for file in files]})
+
+
+def openStore(path):
+    # A tests row for each test run and a wires row for each wire measured, indexed to find the history of a
+    # cable or of a channel
+    db = sqlite3.connect(path, timeout=30)
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS tests (id INTEGER PRIMARY KEY, test TEXT, name TEXT, mapping TEXT,
+            mappingHash TEXT, time TEXT, finished TEXT, passed INTEGER, error TEXT, setup TEXT, reports TEXT);
+        CREATE TABLE IF NOT EXISTS wires (test INTEGER REFERENCES tests(id), row INTEGER, pin44 INTEGER,
+            pin37 INTEGER, pin37B INTEGER, voltages TEXT, r REAL, leakage REAL, expected REAL, voltage REAL,
+            passed INTEGER);
+        CREATE INDEX IF NOT EXISTS testsName ON tests(name, time);
+        CREATE INDEX IF NOT EXISTS wiresTest ON wires(test);
+        CREATE INDEX IF NOT EXISTS wiresPin44 ON wires(pin44);
+        CREATE INDEX IF NOT EXISTS wiresPin37 ON wires(pin37);
+        CREATE INDEX IF NOT EXISTS wiresPin37B ON wires(pin37B);
+    ''')
+    return db
+
+
+def storeWire(row, pin37, voltages, passed, r=None, leakage=None, expected=None, voltage=None, pin37B=None):
+    # Wire verdict of the test being measured, saved to the store with the test and published to the dashboard.
+    # Returns the wires row, see reportWire()
+    n = channelTable.index(row) + 1
+    wire = (n, row[0], pin37, pin37B, json.dumps(voltages), r, leakage, expected, voltage, bool(passed))
+    if 'wires' in storeTest:
+        storeTest['wires'].append(wire)
+    if liveFeed is not None:
+        publish({'event': 'wire', 'test': testPhase, 'row': n, 'rows': len(channelTable), 'pin44': row[0],
+                 'pin37': pin37, 'pin37B': pin37B, 'voltages': [finite(v) for v in voltages], 'r': finite(r),
+                 'leakage': finite(leakage), 'expected': finite(expected), 'voltage': finite(voltage),
+                 'passed': bool(passed)})
+    return wire
+
+
+def storeResults(test, passed, error, files):
+    # Save the test and its wires to the results store in a single transaction
+    if resultsDb is not None and 'time' in storeTest:
+        post('store', (test, name, mappingFile, mappingHash, storeTest['time'].isoformat(),
+                       datetime.now().isoformat(), passed, error, json.dumps(storeTest['setup']),
+                       json.dumps([file.name for file in files])), storeTest['wires'])
+    storeTest.clear()
+
+
+def insertTest(db, test, wires):
+    # test holds the tests columns but the id, wires the wires columns but the test id
+    with db:
+        cursor = db.execute('INSERT INTO tests (test, name, mapping, mappingHash, time, finished, passed, error, '
+                            'setup, reports) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', test)
+        db.executemany('INSERT INTO wires (test, row, pin44, pin37, pin37B, voltages, r, leakage, expected, '
+                       'voltage, passed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       [(cursor.lastrowid,) + tuple(wire) for wire in wires])
+
+
+def openJournal(path, header):
+    # Journal of a new run, starting with the header of the run, or of a resumed run when header is None
+    global journal
+    journal = open(path, 'a')
+    if header is not None:
+        journalWrite(dict(header, record='run'))
+
+
+def loadJournal(path):
+    # Fill journaled with the records of a journal, returns the header of its run
+    header = None
+    with open(path, 'r') as file:
+        lines = file.read().splitlines()
+    for n, line in enumerate(lines):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            if n == len(lines) - 1:
+                # Last record cut short by the interruption
+                break
+            raise
+        if record.get('record') == 'run':
+            header = record
+            continue
+        test = journaled.setdefault(record['test'], {'time': None, 'setup': None, 'rows': {}, 'passed': None})
+        if 'row' in record:
+            test['rows'][record['row']] = record
+        else:
+            for key in ('time', 'setup', 'passed'):
+                if key in record:
+                    test[key] = record[key]
+    if header is None:
+        raise Exception(f"{path} is not a test journal")
+    return header
+
+
+def journalWrite(record):
+    # Records are on disk by the end of the phase, see writeJournal()
+    if journal is not None:
+        post('journal', json.dumps(record) + '\n')
+
+
+def resumed(test, key):
+    return journaled.get(test, {}).get(key)
+
+
+def resumedResult(test):
+    # Result of a test already done by the run being resumed, None when it has to run
+    passed = resumed(test, 'passed')
+    if passed is not None:
+        print(f"{test} test already done: {'PASSED' if passed else 'FAILED'}")
+    return passed
+
+
+def testTime(test, session):
+    # Time of the reports of a test: the one of the run being resumed, so the reports are replaced by the merged
+    # ones, or the session time, or now
+    start = resumed(test, 'time')
+    if start is not None:
+        start = datetime.fromisoformat(start)
+    else:
+        start = datetime.now() if session is None else session
+        journalWrite({'test': test, 'time': start.isoformat()})
+    storeTest.clear()
+    storeTest.update({'time': start, 'setup': None, 'wires': []})
+    publish({'event': 'test', 'test': test, 'name': name, 'rows': len(channelTable)})
+    return start
+
+
+def journalSetup(test, values):
+    # Supply and fixture values measured before the rows, the resumed ones are kept so that all the rows of
+    # the merged report are computed with the same values
+    setup = resumed(test, 'setup')
+    if setup is None:
+        setup = values
+        journalWrite({'test': test, 'setup': values})
+    storeTest['setup'] = setup
+    return setup
+
+
+def journalRow(test, i, voltages, bound=None):
+    record = {'test': test, 'row': i, 'voltages': voltages}
+    if bound is not None:
+        record['bound'] = bound
+    journalWrite(record)
+    return record
+
+
+def reportHeader(test, name, time):
+    return f"LSST Camera Vacuum feedthrough {reportTitles[test]} Test\n{name}\n" + time.strftime('%Y/%m/%d %H:%M:%S\n\n')
+
+
+def reportSetup(test, setup):
+    # The Hi-Pot setup only holds Rtest and minIsolationR until the supply is measured
+    if setup is None:
+        return ''
+    if test == 'Cont. Load':
+        return (f"R37: {EngNumber(setup['R37'])}ohm\nR44: {EngNumber(setup['R44'])}ohm\n"
+                f"R cable threshold: {EngNumber(setup['maxWireR'])}ohm\nPower Supply Voltage: {EngNumber(setup['v5'])}v\n")
+    if test == 'HiPot':
+        text = f"Rtest: {EngNumber(setup['Rtest'])}ohm\nR Threshold : {EngNumber(setup['minIsolationR'])}ohm\n"
+        if 'v250' in setup:
+            text += f"Power supply voltage: {setup['v250']:.3f} v\nRtest: {EngNumber(setup['Rtest'])}ohm\n"
+            text += f"Voltage after Rtest: {EngNumber(setup['Vdmm'])}v\nDMM input impedance: {EngNumber(setup['Rdmm'])}ohm\n"
+        return text
+    return ''
+
+
+def reportWire(test, setup, wire):
+    # Report lines of a wires row, see storeWire()
+    n, pin44, pin37, pin37B, voltages, r, leakage, expected, voltage, passed = wire
+    voltages = json.loads(voltages)
+    valid = 'OK' if passed else 'Error'
+    if test == 'Cont. Load':
+        v0 = 0
+        v5 = setup['v5']
+        # Wire readings expected at half the supply across the load resistors
+        vHalf = 1.66
+        baseline = 'Error'
+        if check(voltages[0], v0, setup['baselineTolerance'])[0] and check(voltages[1], v5, setup['baselineTolerance'])[0]:
+            baseline = 'OK'
+        return (f"    -- {pin44:02d}H {baseline}            {voltages[0]:.2f}|{voltages[1]:.2f} v  ({v0:.2f}|{v5:.2f})v\n"
+                f"{pin37:02d}H -- {pin44:02d}H {valid}  {EngNumber(r)}ohm   {voltages[2]:.2f}|{voltages[3]:.2f} v  ({vHalf:.2f}|{vHalf:.2f})v\n")
+    if test == 'HiPot':
+        v0 = 0
+        v250 = setup['v250']
+        if leakage is None:
+            return f"{pin37:02d}H,{pin37B:02d}H -/- {pin44:02d}H {valid}   HI ohm    - A leakage  {voltages[0]:.2f}|{voltages[1]:.2f} v   ({v0:.2f}|{v250:.2f})v \n"
+        return f"{pin37:02d}H,{pin37B:02d}H -/- {pin44:02d}H {valid}   {EngNumber(r)}ohm   {EngNumber(leakage)}A leakage  {voltages[0]:.2f}|{voltages[1]:.2f} v   ({v0:.2f}|{v250:.2f})v \n"
+    return f"{pin37:02d}H {valid}  {voltage:.2f} v  ({expected:.2f}) v\n"
+
+
+def reportError(test, error):
+    short = {'Cont. Load': 'Cont. Load', 'HiPot': 'Hi-Pot', 'Pinout': 'Pinout'}[test]
+    return f"\n---> {short} Test FAILED!\n\n{error}\n\n\n"
+
+
+def reportSummary(test, passed, setup, wires):
+    # Supply drift, verdict and tables of the good and bad wires ending a report
+    good = [wire for wire in wires if wire[9]]
+    bad = [wire for wire in wires if not wire[9]]
+
+    text = ''
+    if test == 'Cont. Load' and 'drift' in setup:
+        text += f"\nPower Supply drift: {EngNumber(setup['drift'])}v\n"
+    text += "\n-----------------------------------------------------------------------------------\n"
+    if test == 'Cont. Load':
+        table = "pin37\t\tpin47\t\t\n-----\t\t-----\t\t-----\n"
+        lines = lambda wires: ''.join(f"CH{wire[2]}H\t\tCH{wire[1]}H\t\t{EngNumber(wire[5])}ohm\n" for wire in wires)
+        if not passed:
+            text += "\n---> Continuity and Load Test FAILED!\n\n"
+            text += f"{len(good)} of {len(wires)} wires passed the Continuity and Load Test\n\n"
+            text += "These wires passed:\n\n" + table + lines(good)
+            text += "\nThese wires failed:\n\n" + table + lines(bad)
+        else:
+            text += "\n---> Continuity and Load Test PASSED!\n\n"
+            text += f"{len(good)} of {len(wires)} wires passed the Continuity and Load Test\n\n"
+            text += table + lines(good)
+    elif test == 'HiPot':
+        table = "pin37A\tpin37B\t\tpin47\t\t \n------\t------\t\t-----\t\t---------\n"
+        lines = lambda wires: ''.join(f"CH{wire[2]}H\tCH{wire[3]}H\t\tCH{wire[1]}H\t\t{EngNumber(wire[5])}ohm\n" for wire in wires)
+        if not passed:
+            text += "\n---> Hi-Pot Test FAILED!\n\n"
+            text += f"{len(good)} of {len(wires)} pairs of wires passed the Hi-Pot Test\n"
+            text += "These pair of wires passed:\n\n" + table + lines(good)
+            text += "\nThese pair of wires failed:\n\n" + table + lines(bad)
+        else:
+            text += "\n---> Hi-Pot Test PASSED!\n\n"
+            text += f"{len(good)} of {len(wires)} pairs of wires passed the Hi-Pot Test\n\n"
+            text += table + lines(good)
+    else:
+        table = "pin37\t\texpected\t\tread\n-----\t\t--------\t\t----\n"
+        if not passed:
+            lines = lambda wires: ''.join(f"CH{wire[2]}H\t\t{EngNumber(wire[7])}v\t\t\t{EngNumber(wire[8])}v\n" for wire in wires)
+            text += "\n---> Pinout test FAILED!\n\n"
+            text += f"{len(good)} of {len(wires)} wires passed the Pinout Test\n\n"
+            text += "These wires passed:\n\n" + table + lines(good)
+            text += "\nThese wires failed:\n\n" + table + lines(bad)
+        else:
+            lines = lambda wires: ''.join(f"CH{wire[2]}H\t\t{EngNumber(wire[7])}v\t\t{EngNumber(wire[8])}v\n" for wire in wires)
+            text += "\n---> Pinout Test PASSED!\n\n"
+            text += f"{len(good)} of {len(wires)} wires passed the Pinout  Test\n\n"
+            text += table + lines(good)
+    return text + "\n\n"
+
+
+def formatReport(test, name, time, passed, error, setup, wires, rows=None):
+    # Text report of a test from its tests columns and wires rows, as saved to the results store: written by the
+    # tests, see testResult(), and by results.py --report. rows is the number of channelTable rows, the last row
+    # of the wires by default
+    if rows is None:
+        rows = max([wire[0] for wire in wires], default=0)
+    text = reportHeader(test, name, time) + reportSetup(test, setup)
+    row = None
+    for wire in wires:
+        if wire[0] != row:
+            row = wire[0]
+            text += f"\n{reportHeadings[test]} ({row}/{rows})\n"
+        text += reportWire(test, setup, wire)
+    if error is not None:
+        return text + reportError(test, error)
+    return text + reportSummary(test, passed, setup, wires)
+
+
+def reportWrite(string, file2=None, s1=None):
+    # Report text as the test goes, on the console and the Hi-Pot details file, and each line on the front panel
+    # under s1. The report file is written when the test ends, see testResult()
+    if s1 is not None:
+        for line in string.splitlines():
+            show(s1, line)
+    post('console', string)
+    if file2 is not None:
+        post('text', file2, string)
+
+
 def fileWrite(file, string, file2=None):
+    post('text', file, string)
+    post('console', string)
+    if file2 is not None:
+        post('text', file2, string)
+
+
+def consoleWrite(string):
+    # Console line kept in order with the report lines
+    post('console', string + "\n")
+
+
+class ReportSink(threading.Thread):
+    # Write the reports, journal and results store from a background thread, so that a slow disk, network mounted
+    # reports directory or terminal never holds up the measurements. The records posted go to their output of
+    # reportOutputs in the order they were posted. The first error of an output is raised by the next flush()
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.queue = queue.Queue()
+        self.error = None
+
+    def post(self, output, args):
+        self.queue.put((output, args))
+
+    def run(self):
+        while True:
+            output, args = self.queue.get()
+            if output == 'flush':
+                args.set()
+                continue
+            if output == 'stop':
+                return
+            try:
+                reportOutputs[output](*args)
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+
+    def flush(self):
+        # Wait for the records posted so far to be written
+        done = threading.Event()
+        self.queue.put(('flush', done))
+        done.wait()
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def stop(self):
+        self.flush()
+        self.queue.put(('stop', None))
+        self.join()
+
+
+def post(output, *args):
+    # Hand a record to the report sink, started on first use, or write it right away without backgroundReports
+    global reportSink
+    if not backgroundReports:
+        reportOutputs[output](*args)
+        return
+    if reportSink is None:
+        reportSink = ReportSink()
+        reportSink.start()
+    reportSink.post(output, args)
+
+
+def flushReports():
+    if reportSink is not None:
+        reportSink.flush()
+
+
+def stopReports():
+    global reportSink
+    if reportSink is not None:
+        sink = reportSink
+        reportSink = None
+        sink.stop()
+
+
+@contextlib.contextmanager
+def reportFile(path):
+    # Report file written by the report sink, everything posted to it is written when the block ends, also on errors
+    file = open(path, 'w')
+    try:
+        yield file
+    finally:
+        try:
+            flushReports()
+        finally:
+            file.close()
+
+
+@contextlib.contextmanager
+def testReport(test, path):
+    # Report file of a test, see testResult(). A test stopped by an error gets the report of the rows measured
+    # so far followed by the error
+    with reportFile(path) as file:
+        try:
+            yield file
+        except BaseException as e:
+            if 'time' in storeTest:
+                post('text', file, formatReport(test, name, storeTest['time'], False, str(e) or type(e).__name__,
+                                                storeTest['setup'], storeTest['wires'], len(channelTable)))
+            raise
+
+
+def writeText(file, string):
     file.write(string)
+
+
+def writeConsole(string):
     print(string, end='')
-    if file2 is not None:
-        file2.write(string)
+
+
+def writeJournal(line):
+    # Synced to disk record by record, a run interrupted at any point resumes from the last record written
+    journal.write(line)
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def writeStore(test, wires):
+    # The store connection is only used by the sink thread
+    global store
+    if store is None:
+        store = openStore(resultsDb)
+    insertTest(store, test, wires)
+
+
+def notifyListeners(record):
+    for listener in list(listeners):
+        listener(record)
+
+
+def publishLive(event):
+    liveFeed.publish(event)
+
+
+# Outputs of the report sink by name, post(name, *args) calls them with args from the sink thread
+reportOutputs = {'text': writeText, 'console': writeConsole, 'journal': writeJournal, 'store': writeStore,
+                 'listeners': notifyListeners, 'live': publishLive}
 
 
 def errorBeep():
@@ -640,12 +2352,318 @@ def successBeep():
     instr.write("beeper.beep(0.6, 3000)")
 
 
+def runTest(test, options, session=None):
+    # Run a test by its job name, options holds the test options of the command line by dest
+    if test == 'hipot':
+        return hiPotTest(options.get('scan', False), options.get('plan', False), options.get('groups', False), session)
+    if test == 'continuity':
+        return continuityLoadTest(options.get('tsp', False), options.get('plan', False), options.get('screen'), session,
+                                  options.get('bridge', False))
+    return pinoutTest(options.get('scan', False), options.get('plan', False), session)
+
+
+class JobRunner(threading.Thread):
+    # Run the submitted jobs one at a time on the connected instrument. Each job is a fused session of its tests
+    # on a preloaded mapping, its results are the records emitted by the tests
+    tests = ['hipot', 'continuity', 'pinout']
+    options = ['tsp', 'scan', 'plan', 'groups', 'screen', 'bridge']
+
+    def __init__(self, mappings, defaultMapping):
+        super().__init__(daemon=True)
+        self.mappings = mappings
+        self.defaultMapping = defaultMapping
+        self.queue = queue.Queue()
+        self.jobs = {}
+        self.finished = {}
+        self.lock = threading.Lock()
+        self.configured = True
+
+    def submit(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("job: JSON object expected")
+        jobName = request.get('name')
+        mappingName = request.get('mapping', self.defaultMapping)
+        tests = request.get('tests', ['hipot', 'continuity'])
+        options = request.get('options', {})
+        if not isinstance(jobName, str) or jobName == '':
+            raise ValueError("name: cable name missing")
+        if mappingName not in self.mappings:
+            raise ValueError(f"mapping: one of {', '.join(self.mappings)}")
+        if not isinstance(tests, list) or len(tests) == 0 or any(test not in self.tests for test in tests):
+            raise ValueError(f"tests: list of {', '.join(self.tests)}")
+        if not isinstance(options, dict) or any(option not in self.options for option in options):
+            raise ValueError(f"options: object with {', '.join(self.options)}")
+
+        # Requests are handled in parallel threads, the id is allocated and the job registered under the lock
+        with self.lock:
+            job = {'id': len(self.jobs) + 1, 'status': 'queued', 'name': jobName, 'mapping': mappingName,
+                   'tests': tests, 'options': options, 'submitted': datetime.now().isoformat(), 'finished': None,
+                   'error': None, 'results': []}
+            self.finished[job['id']] = threading.Event()
+            self.jobs[job['id']] = job
+        self.queue.put(job)
+        return job
+
+    def run(self):
+        while True:
+            self.runJob(self.queue.get())
+
+    def runJob(self, job):
+        global name, rawTable, channelTable, compiledPlan, mappingFile, mappingHash
+        job['status'] = 'running'
+        rawTable, channelTable, compiledPlan, mappingFile, mappingHash = self.mappings[job['mapping']]
+        name = job['name']
+        listeners.append(job['results'].append)
+        try:
+            if not self.configured:
+                preConfiguration()
+                self.configured = True
+            session = datetime.now()
+            for test in job['tests']:
+                runTest(test, job['options'], session)
+            job['status'] = 'done'
+        except Exception as e:
+            # The instrument state is unknown, configure it again for the next job
+            job['status'] = 'failed'
+            job['error'] = repr(e)
+            self.configured = False
+        finally:
+            listeners.remove(job['results'].append)
+            job['finished'] = datetime.now().isoformat()
+            self.finished[job['id']].set()
+
+
+class JobHandler(BaseHTTPRequestHandler):
+    # GET /mappings, GET /jobs, GET /jobs/<id>, and POST /jobs with a JSON job
+    # {"name": ..., "mapping": ..., "tests": [...], "options": {...}}, add ?wait to reply when it is finished
+    runner = None
+
+    def do_GET(self):
+        path = urlparse(self.path).path.strip('/').split('/')
+        if path == ['mappings']:
+            self.reply(200, list(self.runner.mappings))
+        elif path == ['jobs']:
+            self.reply(200, [{key: job[key] for key in ('id', 'status', 'name', 'submitted', 'finished')}
+                             for job in list(self.runner.jobs.values())])
+        elif len(path) == 2 and path[0] == 'jobs' and path[1].isdigit() and int(path[1]) in self.runner.jobs:
+            self.reply(200, self.runner.jobs[int(path[1])])
+        else:
+            self.reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/jobs':
+            self.reply(404, {'error': 'not found'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            job = self.runner.submit(request)
+        except ValueError as e:
+            self.reply(400, {'error': str(e)})
+            return
+        if 'wait' in parse_qs(url.query, keep_blank_values=True):
+            self.runner.finished[job['id']].wait()
+            self.reply(200, job)
+        else:
+            self.reply(202, job)
+
+    def reply(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class JobServer(ThreadingHTTPServer):
+    # Connections waiting to be accepted, the socketserver default of 5 resets the submissions arriving together
+    request_queue_size = 64
+
+
+def serveJobs(host, port, mappings, defaultMapping):
+    JobHandler.runner = JobRunner(mappings, defaultMapping)
+    JobHandler.runner.start()
+    with JobServer((host, port), JobHandler) as server:
+        print(f"Waiting for jobs on http://{host}:{port}/jobs")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+class LiveFeed:
+    # State of the test being measured and the events of its measurements for the dashboard clients. publish() never
+    # waits on a client: each one has a queue of at most backlog events, a client falling behind loses its queued
+    # events and gets the current state instead
+    def __init__(self, backlog):
+        self.backlog = backlog
+        self.lock = threading.Lock()
+        self.clients = []
+        self.dropped = 0
+        self.state = {'name': None, 'test': None, 'rows': 0, 'row': 0, 'started': None, 't': None, 'status': [],
+                      'wires': {}, 'results': []}
+
+    def publish(self, event):
+        with self.lock:
+            self.update(event)
+            for client in self.clients:
+                try:
+                    client.put_nowait(event)
+                except queue.Full:
+                    self.resync(client)
+
+    def update(self, event):
+        state = self.state
+        state['t'] = event['t']
+        if event['event'] == 'test':
+            state.update(name=event['name'], test=event['test'], rows=event['rows'], row=0, started=event['t'],
+                         wires={})
+        elif event['event'] == 'row':
+            state.update(test=event['test'], rows=event['rows'], row=event['row'])
+        elif event['event'] == 'wire':
+            state['wires'][f"{event['test']}/{event['pin44']}/{event['pin37']}"] = event
+        elif event['event'] == 'status':
+            state['status'] = event['lines']
+        elif event['event'] == 'result':
+            state['results'].append(event)
+
+    def snapshot(self):
+        return dict(self.state, event='state', wires=list(self.state['wires'].values()),
+                    results=list(self.state['results']))
+
+    def resync(self, client):
+        self.dropped += 1
+        while True:
+            try:
+                client.get_nowait()
+            except queue.Empty:
+                break
+        client.put_nowait(self.snapshot())
+
+    def subscribe(self):
+        client = queue.Queue(self.backlog)
+        with self.lock:
+            client.put_nowait(self.snapshot())
+            self.clients.append(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self.clients.remove(client)
+
+
+class LiveHandler(BaseHTTPRequestHandler):
+    # GET / the dashboard page, GET /state the current state as JSON, GET /events the state then the events as
+    # Server-Sent Events
+    feed = None
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip('/')
+        if path == '':
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dashboard.html'), 'rb') as file:
+                self.send(200, 'text/html; charset=utf-8', file.read())
+        elif path == '/state':
+            with self.feed.lock:
+                state = self.feed.snapshot()
+            self.send(200, 'application/json', json.dumps(state).encode())
+        elif path == '/events':
+            self.stream()
+        else:
+            self.send(404, 'application/json', json.dumps({'error': 'not found'}).encode())
+
+    def stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        client = self.feed.subscribe()
+        try:
+            while True:
+                try:
+                    self.wfile.write(f"data: {json.dumps(client.get(timeout=15))}\n\n".encode())
+                except queue.Empty:
+                    # Keeps the connection open, and finds the clients that went away
+                    self.wfile.write(b": keepalive\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.feed.unsubscribe(client)
+
+    def send(self, code, contentType, body):
+        self.send_response(code)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # The console shows the reports
+        pass
+
+
+def startLive(host, port):
+    # Serve the dashboard from a background thread, each client in a thread of its own
+    global liveFeed
+    liveFeed = LiveFeed(liveBacklog)
+    LiveHandler.feed = liveFeed
+    server = ThreadingHTTPServer((host, port), LiveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Live results on http://{host}:{port}/")
+
+
+def publish(event):
+    # Dashboard event, timed here but handed to the clients by the report sink
+    if liveFeed is not None:
+        post('live', dict(event, t=time.time()))
+
+
+def finite(value):
+    # JSON has no inf and nan
+    if value is None or abs(value) == float('inf') or value != value:
+        return None
+    return value
+
+
 def parse_args(args):
     parser = argparse.ArgumentParser()
     parser.add_argument('-cl', dest='contLoad', help='Run Continuity and Load test', action="store_true")
     parser.add_argument('-hp', dest='hiPot', help='Run Hi-Pot test', action="store_true")
     parser.add_argument('-t', dest='tests', help='Run Continuity and Load and Hi-Pot test', action="store_true")
     parser.add_argument('-p', dest='pinout', help='Run Pinout test', action="store_true")
+    parser.add_argument('--fused', dest='fused', help='Run the selected tests in a single instrument session, without resetting it between tests', action="store_true")
+    parser.add_argument('--compile', dest='compile', help='Validate the mapping, compile its test plan to the plans directory and exit', action="store_true")
+    parser.add_argument('--tsp', dest='tsp', help='Run the Continuity and Load sequence on the instrument as a TSP script', action="store_true")
+    parser.add_argument('--scan', dest='scan', help='Run the Hi-Pot and Pinout tests with the instrument scanner', action="store_true")
+    parser.add_argument('--coalesce', dest='coalesce', help='Send consecutive commands to the instrument as a single message', action="store_true")
+    parser.add_argument('--display-rate', dest='displayRate', type=float, help='Update the instrument display from a background thread, at most DISPLAYRATE times per second')
+    parser.add_argument('--error-check', dest='errorCheck', choices=['reading', 'row', 'phase', 'status'], default='reading', help='Check the instrument error queue after each reading, row or phase, or only when the status byte reports an error (DEFAULT: reading)')
+    parser.add_argument('--track-relays', dest='trackRelays', help='Keep track of the relay states and only send the operations that change them', action="store_true")
+    parser.add_argument('--verify-relays', dest='verifyRelays', choices=['never', 'row', 'phase'], default='phase', help='Check the tracked relay states against the instrument after each row or phase (DEFAULT: phase)')
+    parser.add_argument('--plan', dest='plan', help='Reorder the channels to minimize relay actuations with --track-relays, reports keep the mapping order', action="store_true")
+    parser.add_argument('--dry-run', dest='dryRun', help='Run the selected tests (all of them without -cl, -hp, -t or -p) on the simulated 3700A, print the operations they send and their time on the bench with the --sim-latency figures and exit', action="store_true")
+    parser.add_argument('--plan-estimate', dest='planEstimate', help='Print the relay actuations and DMM autodelays saved by --plan for each test and exit', action="store_true")
+    parser.add_argument('--groups', dest='groups', help='Run the Hi-Pot test on groups of channels, testing channels alone only when a group fails', action="store_true")
+    parser.add_argument('--bridge', dest='bridge', help='Measure the load resistors of the Continuity and Load test once and the baseline of each 44 pins channel once for both wires', action="store_true")
+    parser.add_argument('--results-db', dest='resultsDb', help='SQLite database the results of the tests are saved to, see results.py (DEFAULT: reports/results.db, none with --transport sim or --replay)')
+    parser.add_argument('--sync-reports', dest='syncReports', help='Write the reports, journal and results database from the test thread instead of a background thread', action="store_true")
+    parser.add_argument('--resume', dest='resume', help='Continue the run interrupted while writing the RESUME journal, with the tests and options of that run, and merge the reports')
+    parser.add_argument('--screen', dest='screen', type=float, help='Run the Continuity and Load test with fast DMM settings first and re-measure at full precision the rows within SCREEN (fraction of the limits) of a limit')
+    parser.add_argument('--calibrate', dest='calibrate', help='Find the fastest DMM settings meeting the tolerances of each measurement, save them to PROFILES and exit', action="store_true")
+    parser.add_argument('--profiles', dest='profiles', default='dmm_profiles.json', help='DMM settings file used when present (DEFAULT: dmm_profiles.json)')
+    parser.add_argument('--trace', dest='trace', help='Record every instrument call and save them to TRACE in the Chrome trace-event format')
+    parser.add_argument('--trace-top', dest='traceTop', type=int, default=10, help='Number of commands in the time per command table printed with --trace (DEFAULT: 10)')
+    parser.add_argument('--record', dest='record', help='Save every command sent to the instrument and its responses to the RECORD transcript')
+    parser.add_argument('--replay', dest='replay', help='Replay the responses of a transcript saved with --record instead of connecting to the instrument')
+    parser.add_argument('--daemon', dest='daemon', type=int, help='Keep the instrument connected and run the test jobs received over HTTP on port DAEMON')
+    parser.add_argument('--daemon-host', dest='daemonHost', default='127.0.0.1', help='Address the --daemon HTTP server listens on (DEFAULT: 127.0.0.1)')
+    parser.add_argument('--live', dest='live', type=int, help='Publish the measurements as they are taken and serve a live dashboard on port LIVE')
+    parser.add_argument('--live-host', dest='liveHost', default='127.0.0.1', help='Address the --live HTTP server listens on (DEFAULT: 127.0.0.1)')
+    parser.add_argument('--display-link', dest='displayLink', choices=['shared', 'separate'], default='shared', help='Connection used by the background display updates (DEFAULT: shared)')
+    parser.add_argument('--transport', dest='transport', choices=['vxi11', 'socket', 'sim'], default='vxi11', help='Connect with VXI-11, a raw socket on port 5025, or to a simulated 3700A and feedthrough built from the mapping file (DEFAULT: vxi11)')
+    parser.add_argument('--sim-faults', dest='simFaults', default='', help='Comma separated faults of the simulated feedthrough: open:PIN37, res:PIN37:OHMS, leak:PIN44:PIN37:OHMS or leak:PIN44:gnd:OHMS')
+    parser.add_argument('--sim-latency', dest='simLatency', help='Comma separated KIND=SECONDS simulated latencies, KIND in ' + ', '.join(keithleySim.latency) + ', or a JSON file of them')
+    parser.add_argument('--sim-realtime', dest='simRealtime', help='Sleep for the simulated latencies', action="store_true")
     parser.add_argument('-n', dest='name', help='Append a name to the report files')
     parser.add_argument('-ip', dest='ip', help='Keithley IP address (DEFAULT: "134.79.217.93")')
     parser.add_argument('-m', dest='mapping', help='Channels mapping csv file (Overides --corner_raft and --science_raft)')
@@ -660,8 +2678,15 @@ def parse_args(args):
 
 if __name__ == "__main__":
     args = parse_args(sys.argv)
+    runDone = False
 
     try:
+        header = None
+        if args.resume is not None:
+            header = loadJournal(args.resume)
+            for key in journalArgs:
+                setattr(args, key, header['args'][key])
+
         ip = "134.79.217.93"
         #ip = "dmm-b084-test1"
         if args.ip is not None:
@@ -674,26 +2699,104 @@ if __name__ == "__main__":
             mapping = args.mapping
 
         readCsv(mapping)
+        if header is not None and header['sha256'] != mappingHash:
+            raise Exception(f"{mapping} changed since {args.resume} was written")
+        errorCheck = args.errorCheck
+        relayTracking = args.trackRelays
+        relayVerify = args.verifyRelays
+        # Simulated and replayed tests are not saved unless asked, they would be taken for measured cables
+        resultsDb = args.resultsDb
+        if resultsDb is None and args.transport != 'sim' and args.replay is None:
+            resultsDb = 'reports/results.db'
+        backgroundReports = not args.syncReports
+
+        if args.compile:
+            print(f"{len(channelTable)} rows, " + ', '.join(f"{test}: {sum(len(rowVariants[0]) for rowVariants in variants)} operations" for test, variants in compiledPlan.items()))
+            sys.exit(0)
+
+        if args.planEstimate:
+            estimatePlans()
+            sys.exit(0)
+
+        if os.path.exists(args.profiles):
+            loadProfiles(args.profiles)
+
+        if args.dryRun:
+            tests = []
+            for selected, selectedTests in ((args.hiPot, ['hipot']), (args.contLoad, ['continuity']),
+                                            (args.tests, ['hipot', 'continuity']), (args.pinout, ['pinout'])):
+                if selected:
+                    tests += selectedTests
+            dryRun(mapping, tests or JobRunner.tests, vars(args), datetime.now() if args.fused else None,
+                   [fault for fault in args.simFaults.split(',') if fault != ''],
+                   keithleySim.parseLatencies(args.simLatency) if args.simLatency is not None else None)
+            sys.exit(0)
+
+        simulation = None
+        if args.transport == 'sim':
+            simulation = {'mapping': mapping,
+                          'faults': [fault for fault in args.simFaults.split(',') if fault != ''],
+                          'realtime': args.simRealtime}
+            if args.simLatency is not None:
+                simulation['latencies'] = keithleySim.parseLatencies(args.simLatency)
+
         print("Connecting to Keithley Tester...")
-        connect(ip)
+        connect(ip, args.coalesce, simulation, args.trace is not None, args.record, args.replay, args.transport)
+        if args.displayRate is not None:
+            startDisplay(ip, args.displayRate, args.displayLink == 'separate')
+
+        if args.calibrate:
+            calibrate(args.profiles)
+            sys.exit(0)
+
+        if args.live is not None:
+            startLive(args.liveHost, args.live)
+
         preConfiguration()
         global name
         name = ''
 
+        if args.daemon is not None:
+            # Preload the mappings the jobs can use
+            mappings = {}
+            for key, path in (('science', 'science_raft_channel_mapping.csv'), ('corner', 'corner_raft_channel_mapping.csv'),
+                              (os.path.basename(mapping), mapping)):
+                if os.path.exists(path):
+                    readCsv(path)
+                    mappings[key] = (rawTable, channelTable, compiledPlan, mappingFile, mappingHash)
+            serveJobs(args.daemonHost, args.daemon, mappings, os.path.basename(mapping))
+            sys.exit(0)
+
         if args.name is not None:
             name = args.name
         else:
             name = input("\nName of the cable being tested:")
 
+        # Tests of a fused session share the configuration done above and the report header
+        session = datetime.now() if args.fused else None
+
+        # Journal the measurements as they are taken, an interrupted run continues from it with --resume
+        if header is not None:
+            if header['session'] is not None:
+                session = datetime.fromisoformat(header['session'])
+            openJournal(args.resume, None)
+            print(f"Resuming the run of {args.resume}")
+        else:
+            args.name = name
+            args.mapping = mapping
+            openJournal("reports/journal_" + datetime.now().strftime('%Y_%m_%d_%Hh%Mm%Ss') + f"_{name}.jsonl",
+                        {'args': {key: getattr(args, key) for key in journalArgs}, 'sha256': mappingHash,
+                         'session': session.isoformat() if session is not None else None})
+
         if args.hiPot:
-            hiPotTest()
+            hiPotTest(args.scan, args.plan, args.groups, session)
 
         if args.contLoad:
-            continuityLoadTest()
+            continuityLoadTest(args.tsp, args.plan, args.screen, session, args.bridge)
 
         if args.tests:
-            hiPot = hiPotTest()
-            contLoad = continuityLoadTest()
+            hiPot = hiPotTest(args.scan, args.plan, args.groups, session)
+            contLoad = continuityLoadTest(args.tsp, args.plan, args.screen, session, args.bridge)
 
             if hiPot and contLoad:
                 print("\n\n---------------------------------------------------------------------------------------------------\n")
@@ -721,7 +2824,7 @@ if __name__ == "__main__":
 
 
         if args.pinout:
-            pinout = pinoutTest()
+            pinout = pinoutTest(args.scan, args.plan, session)
 
             print("\n\n---------------------------------------------------------------------------------------------------\n")
             if pinout:
@@ -736,10 +2839,36 @@ if __name__ == "__main__":
                 errorBeep()
             print("\n---------------------------------------------------------------------------------------------------\n")
 
+        runDone = True
 
     except Exception as e:
-        show("Error!", "Python script error")
+        if instr is not None:
+            show("Error!", "Python script error")
         raise (e)
     finally:
-        instr.close()
-        print("Connection closed")
+        stopDisplay()
+        try:
+            stopReports()
+        finally:
+            if journal is not None:
+                journal.close()
+                if not runDone:
+                    print(f"Run interrupted, continue it with --resume {journal.name}")
+        if instr is not None:
+            instr.close()
+            print("Connection closed")
+            coalescing = findWrapper(CoalescingInstrument)
+            if coalescing is not None:
+                print(coalescing.summary())
+            if simulator is not None:
+                print(simulator.summary())
+            base = instr
+            while isinstance(base, InstrumentWrapper):
+                base = base.instrument
+            if isinstance(base, ReplayInstrument):
+                print(base.summary())
+            tracing = findWrapper(TracingInstrument)
+            if tracing is not None:
+                tracing.export(args.trace)
+                print(tracing.summary(args.traceTop))
+                print(f"Trace saved to {args.trace}")